@@ -0,0 +1,220 @@
+"""Local stand-in for the hosts mega_dl talks to, for offline benchmarks.
+
+One FakeHost serves a set of files under several URL shapes:
+
+    /api/list/<album>   Pixeldrain-style JSON listing
+    /api/file/<id>      Pixeldrain-style file download
+    /a/<album>          Bunkr/K00-style HTML album page linking to /f/<name>
+    /f/<name>           plain direct file
+
+Every file endpoint honours Range and HEAD. Latency (before the response
+headers), per-connection bandwidth (optionally dropping once a given amount
+has been served), injected 429s and dropped connections are configurable. File bodies are generated from a repeating random block, so
+multi-GB files cost no memory.
+
+    python benchmarks/fakehost.py --files 100 --size-kb 512 --latency-ms 20
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BLOCK = random.Random(0).randbytes(1024 * 1024)
+SEND_SIZE = 256 * 1024
+
+class FakeHost:
+    def __init__(self, files, album="bench", latency=0.0, bandwidth=0, rate_limit=0, throttle_rate=0.0,
+                 retry_after=1, drop_rate=0.0, degrade_after=0, degraded_bandwidth=0, seed=0, port=0):
+        # files: {name: size}. bandwidth is bytes/s per connection, 0 = unthrottled.
+        # rate_limit answers file requests beyond that many per second and client IP
+        # with a 429, the way real hosts do; throttle_rate and drop_rate are the share
+        # of file requests answered with a random 429 or cut off halfway through the body.
+        # Once degrade_after body bytes have been served, bandwidth drops to degraded_bandwidth.
+        self.files = dict(files)
+        self.ids = {f"id{i}": name for i, name in enumerate(self.files)}
+        self.album = album
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.rate_limit = rate_limit
+        self.buckets = {}  # client IP -> (tokens, refilled)
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+        self.degrade_after = degrade_after
+        self.degraded_bandwidth = degraded_bandwidth
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "dropped": 0, "bytes": 0}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.netloc = f"127.0.0.1:{self.server.server_port}"
+        self.base = f"http://{self.netloc}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def content(self, name, start, end):
+        # Bytes start..end (inclusive) of a file; the offset into BLOCK depends on the name
+        shift = sum(name.encode()) * 4099 % len(BLOCK)
+        out = bytearray()
+        pos = start
+        while pos <= end:
+            i = (pos + shift) % len(BLOCK)
+            n = min(len(BLOCK) - i, end + 1 - pos)
+            out += BLOCK[i:i + n]
+            pos += n
+        return bytes(out)
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def _over_limit(self, client):
+        # Token bucket per client IP holding one second's worth of requests
+        if self.rate_limit <= 0:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            tokens, refilled = self.buckets.get(client, (float(self.rate_limit), now))
+            tokens = min(self.rate_limit, tokens + (now - refilled) * self.rate_limit)
+            over = tokens < 1
+            self.buckets[client] = (tokens if over else tokens - 1, now)
+            return over
+
+    def _roll(self, rate):
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def _handler(self):
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(body=False)
+
+            def do_GET(self, body=True):
+                host._count("requests")
+                if host.latency:
+                    time.sleep(host.latency)
+                path = self.path.split("?")[0]
+                m = re.fullmatch(r"/api/list/([^/]+)", path)
+                if m:
+                    files = [{"id": i, "name": n, "size": host.files[n]} for i, n in host.ids.items()]
+                    return self._send_bytes(json.dumps({"name": host.album, "files": files}).encode(),
+                                            "application/json", body)
+                if re.fullmatch(r"/a/([^/]+)", path):
+                    links = "".join(f'<a href="{host.base}/f/{n}">{n}</a>\n' for n in host.files)
+                    return self._send_bytes(f"<html><body>\n{links}</body></html>".encode(), "text/html", body)
+                m = re.fullmatch(r"/api/file/([^/]+)", path)
+                name = host.ids.get(m.group(1)) if m else None
+                m = re.fullmatch(r"/f/([^/]+)", path)
+                if m and m.group(1) in host.files:
+                    name = m.group(1)
+                if name is None:
+                    return self._send_bytes(b"not found", "text/plain", body, status=404)
+                self._send_file(name, body)
+
+            def _send_bytes(self, data, content_type, body, status=200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+            def _send_file(self, name, body):
+                if host._over_limit(self.client_address[0]) or host._roll(host.throttle_rate):
+                    host._count("throttled")
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(host.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                size = host.files[name]
+                start, end = 0, size - 1
+                m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if m and int(m.group(1)) < size:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{name}-{size}"')
+                self.end_headers()
+                if not body:
+                    return
+                # A dropped connection stops halfway through the body
+                stop = end + 1
+                if host._roll(host.drop_rate):
+                    host._count("dropped")
+                    stop = start + (end + 1 - start) // 2
+                    self.close_connection = True
+                began = time.monotonic()
+                sent = 0
+                pace = host.bandwidth
+                pos = start
+                while pos < stop:
+                    n = min(SEND_SIZE, stop - pos)
+                    try:
+                        self.wfile.write(host.content(name, pos, pos + n - 1))
+                    except OSError:
+                        self.close_connection = True
+                        break
+                    pos += n
+                    sent += n
+                    host._count("bytes", n)
+                    if host.degrade_after and pace != host.degraded_bandwidth and \
+                            host.stats["bytes"] >= host.degrade_after:
+                        pace, began, sent = host.degraded_bandwidth, time.monotonic(), 0
+                    if pace:
+                        ahead = sent / pace - (time.monotonic() - began)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake album hosts for benchmarks")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--bandwidth-kb", type=int, default=0, help="Per-connection KB/s (0 = unthrottled)")
+    parser.add_argument("--rate-limit", type=int, default=0, help="File requests per second before 429s (0 = off)")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Share of file requests answered with a random 429")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Share of file requests cut off mid-body")
+    args = parser.parse_args()
+
+    files = {f"file{i:05d}.jpg": args.size_kb * 1024 for i in range(args.files)}
+    host = FakeHost(files, latency=args.latency_ms / 1000, bandwidth=args.bandwidth_kb * 1024,
+                    rate_limit=args.rate_limit, throttle_rate=args.throttle_rate, drop_rate=args.drop_rate, port=args.port).start()
+    print(f"Pixeldrain list: {host.base}/l/bench  (API under {host.base}/api)")
+    print(f"Album page:      {host.base}/a/bench")
+    print(f"Direct file:     {host.base}/f/{next(iter(files))}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        host.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""End-to-end scenarios through the real adapters and queue_worker, against fakehost.
+
+Each scenario starts one or more FakeHost servers in this process and runs the
+download in a child process, so the reported CPU time and peak RSS belong to
+mega_dl alone. Results are printed as a table and can be saved as JSON and
+compared against an earlier run:
+
+    python benchmarks/scenarios.py --json before.json
+    python benchmarks/scenarios.py --json after.json --compare before.json
+    python benchmarks/scenarios.py --scenario flaky-host --engine async
+    python benchmarks/scenarios.py --scenario skewed-album --order largest
+    python benchmarks/scenarios.py --scenario bunkr-mirrors
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakehost import FakeHost  # noqa: E402
+
+KB, MB = 1024, 1024 * 1024
+
+# kind picks the adapter: pixeldrain (JSON API), bunkr/k00 (HTML album page) or
+# direct (one SingleFile URL per file). big_files of big_size are listed last. mirrors
+# extra hosts at mirror_bandwidth serve the same files as Bunkr mirrors of the first,
+# which slows down to degraded_bandwidth once it has served degrade_after bytes.
+SCENARIOS = {
+    "many-small": dict(kind="bunkr", files=2000, size=16 * KB, latency=0.005),
+    "few-huge": dict(kind="pixeldrain", files=4, size=256 * MB),
+    "flaky-host": dict(kind="k00", files=300, size=256 * KB, latency=0.01, rate_limit=40,
+                       throttle_rate=0.01, drop_rate=0.05, retry_after=1),
+    "direct-files": dict(kind="direct", files=20, size=4 * MB, latency=0.02, bandwidth=8 * MB),
+    "skewed-album": dict(kind="pixeldrain", files=64, size=1 * MB, big_files=3, big_size=48 * MB,
+                         latency=0.005, bandwidth=8 * MB),
+    "bunkr-mirrors": dict(kind="bunkr", files=24, size=8 * MB, latency=0.005, bandwidth=8 * MB, mirrors=2,
+                          mirror_bandwidth=2 * MB, degrade_after=48 * MB, degraded_bandwidth=128 * KB),
+}
+
+COLUMNS = [
+    ("scenario", "{:<14}"), ("MB", "{:>8.1f}"), ("wall_s", "{:>8.2f}"), ("MB_s", "{:>8.1f}"),
+    ("files_s", "{:>8.1f}"), ("p50_s", "{:>7.3f}"), ("p99_s", "{:>7.3f}"), ("ttfb_p99_ms", "{:>11.1f}"),
+    ("cpu_s", "{:>7.2f}"), ("rss_MB", "{:>7.1f}"), ("retries", "{:>7}"), ("http_429", "{:>8}"),
+    ("ok", "{:>4}"),
+]
+
+def quantile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def child(spec):
+    # Runs inside the child process: point mega_dl at the fake host, download, report
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import mega_dl
+
+    class RecordingMetrics(mega_dl.Metrics):
+        # Keeps raw samples as well, for exact percentiles
+        def __init__(self):
+            super().__init__()
+            self.samples = collections.defaultdict(list)
+
+        def observe(self, name, value, **labels):
+            super().observe(name, value, **labels)
+            self.samples[name].append(value)
+
+    netloc, base = spec["netloc"], spec["base"]
+    link_pattern = re.escape(base) + r"""/f/[^\s"']+"""
+    if spec["kind"] == "pixeldrain":
+        mega_dl.PIXELDRAIN_DOMAINS.append(netloc)
+    elif spec["kind"] == "bunkr":
+        # Only the fake hosts, so mirror probes never reach the real Bunkr
+        mega_dl.BUNKR_DOMAINS[:] = [netloc] + spec["mirrors"]
+        mega_dl.BunkrAdapter.LINK_PATTERN = link_pattern
+    elif spec["kind"] == "k00":
+        mega_dl.K00_DOMAINS.append(netloc)
+        mega_dl.K00Adapter.LINK_PATTERN = link_pattern
+
+    mega_dl.BASE_DIR = spec["out"]
+    mega_dl.SEGMENTS = spec["segments"]
+    mega_dl.ORDER = spec["order"]
+    mega_dl.metrics = metrics = RecordingMetrics()
+    mega_dl.limiter.set_limits(0)
+    mega_dl.sessions.configure(spec["workers"] * spec["segments"])
+    per_host = spec["per_host"]
+    if per_host is None:
+        per_host = spec["workers"] if spec["engine"] == "async" else mega_dl.PER_HOST_WORKERS
+    messages = []
+    threading.Thread(target=mega_dl.queue_worker, daemon=True,
+                     args=(messages.append, False, None, spec["workers"], per_host, spec["engine"])).start()
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    for url in spec["urls"]:
+        mega_dl.album_queue.put(url)
+    mega_dl.album_queue.join()
+    wall = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    on_disk = 0
+    for root, dirs, files in os.walk(spec["out"]):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        on_disk += sum(os.path.getsize(os.path.join(root, f)) for f in files if not f.startswith("."))
+    counters = collections.Counter()
+    for (name, labels), value in metrics.counters.items():
+        counters[name] += value
+    durations = metrics.samples["transfer_seconds"]
+    result = {
+        "bytes": on_disk,
+        "wall_s": wall,
+        "MB": on_disk / MB,
+        "MB_s": on_disk / MB / wall,
+        "files_s": len(durations) / wall,
+        "p50_s": quantile(durations, 0.5),
+        "p99_s": quantile(durations, 0.99),
+        "ttfb_p99_ms": quantile(metrics.samples["ttfb_seconds"], 0.99) * 1000,
+        "cpu_s": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        "rss_MB": after.ru_maxrss / 1024,  # KB on Linux
+        "retries": int(counters["retries_total"]),
+        "http_429": int(counters["throttled_total"]),
+        "failed": int(counters.get("gave_up_total", 0)),
+    }
+    print("RESULT " + json.dumps(result))
+
+def run(name, params, args):
+    scale = args.scale
+    count = max(1, int(params["files"] * scale))
+    big = min(params.get("big_files", 0), count)
+    files = {f"{name}-{i:05d}.jpg": params["big_size"] if i >= count - big else params["size"] for i in range(count)}
+    host = FakeHost(files, album=name, latency=params.get("latency", 0.0),
+                    bandwidth=params.get("bandwidth", 0), rate_limit=params.get("rate_limit", 0),
+                    throttle_rate=params.get("throttle_rate", 0.0),
+                    retry_after=params.get("retry_after", 1), drop_rate=params.get("drop_rate", 0.0),
+                    degrade_after=params.get("degrade_after", 0),
+                    degraded_bandwidth=params.get("degraded_bandwidth", 0)).start()
+    mirrors = [FakeHost(files, album=name, latency=params.get("latency", 0.0),
+                        bandwidth=params.get("mirror_bandwidth", 0)).start() for _ in range(params.get("mirrors", 0))]
+    kind = params["kind"]
+    if kind == "pixeldrain":
+        urls = [f"{host.base}/l/{name}"]
+    elif kind in ("bunkr", "k00"):
+        urls = [f"{host.base}/a/{name}"]
+    else:
+        urls = [f"{host.base}/f/{n}" for n in files]
+
+    with tempfile.TemporaryDirectory(prefix="megadl-bench-") as out:
+        spec = {"kind": kind, "netloc": host.netloc, "base": host.base, "urls": urls, "out": out,
+                "mirrors": [m.netloc for m in mirrors],
+                "workers": args.workers, "segments": args.segments, "engine": args.engine, "order": args.order,
+                "per_host": args.per_host}
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                              stdout=subprocess.PIPE, text=True)
+    host.stop()
+    for mirror in mirrors:
+        mirror.stop()
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("RESULT ")]
+    if proc.returncode or not lines:
+        sys.stdout.write(proc.stdout)
+        raise SystemExit(f"scenario {name} failed (exit {proc.returncode})")
+    result = json.loads(lines[-1][len("RESULT "):])
+    result["scenario"] = name
+    result["ok"] = "yes" if result["bytes"] == sum(files.values()) else "NO"
+    result["server"] = dict(host.stats)
+    if mirrors:
+        result["mirrors"] = [dict(m.stats) for m in mirrors]
+    result["settings"] = {"engine": args.engine, "workers": args.workers, "per_host": args.per_host,
+                          "segments": args.segments, "order": args.order, "scale": scale}
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end download benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run, repeatable (default: all)")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, help="Files in flight per host (default: mega_dl's own default)")
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--order", choices=["listing", "largest", "smallest"], default="listing")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every scenario's file count")
+    parser.add_argument("--json", help="Save results to this file")
+    parser.add_argument("--compare", help="Earlier --json results to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r["scenario"]: r for r in json.load(f)}
+
+    print(" ".join(fmt.replace(".1f", "").replace(".2f", "").replace(".3f", "").format(col)
+                   for col, fmt in COLUMNS))
+    results = []
+    for name in args.scenario or SCENARIOS:
+        result = run(name, SCENARIOS[name], args)
+        results.append(result)
+        print(" ".join(fmt.format(result[col]) for col, fmt in COLUMNS))
+        old = baseline.get(name)
+        if old:
+            if old.get("settings") != result["settings"]:
+                print(f"{'':<14} (baseline ran with {old.get('settings')})")
+            print(f"{'':<14} vs baseline: MB/s x{result['MB_s'] / max(old['MB_s'], 1e-9):.2f}, "
+                  f"p99 x{result['p99_s'] / max(old['p99_s'], 1e-9):.2f}, "
+                  f"CPU x{result['cpu_s'] / max(old['cpu_s'], 1e-9):.2f}, "
+                  f"RSS x{result['rss_MB'] / max(old['rss_MB'], 1e-9):.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Startup cost of mega_dl for short headless CLI invocations (cron, job runners).
+
+Times fresh interpreter runs of `import mega_dl` and `mega_dl.py --help`, and
+lists the slowest imports reported by `python -X importtime`. Point --script at
+another copy (e.g. `git show HEAD~1:mega_dl.py > /tmp/old/mega_dl.py`) to compare.
+
+    python benchmarks/startup.py --runs 20
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timed(cmd, cwd, env):
+    started = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+def slowest_imports(script_dir, env, top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import mega_dl"], cwd=script_dir,
+                         env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True).stderr
+    rows = []
+    for line in out.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            depth = (len(name) - len(name.lstrip())) // 2
+            if depth == 1:  # Imported directly by mega_dl
+                rows.append((int(parts[1]), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=8, help="Slowest direct imports to list")
+    parser.add_argument("--script", default=os.path.join(REPO, "mega_dl.py"))
+    args = parser.parse_args()
+
+    script_dir = os.path.dirname(os.path.abspath(args.script))
+    # Run from the script's directory so "import mega_dl" picks that copy
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [script_dir, os.environ.get("PYTHONPATH")])))
+    cases = [
+        ("interpreter only", [sys.executable, "-c", "pass"]),
+        ("import mega_dl", [sys.executable, "-c", "import mega_dl"]),
+        ("mega_dl.py --help", [sys.executable, args.script, "--help"]),
+    ]
+    print(f"{'case':<20} {'median ms':>10} {'min ms':>8}")
+    for name, cmd in cases:
+        timed(cmd, script_dir, env)  # Warm the page cache and .pyc files
+        samples = [timed(cmd, script_dir, env) for _ in range(args.runs)]
+        print(f"{name:<20} {statistics.median(samples) * 1000:>10.1f} {min(samples) * 1000:>8.1f}")
+
+    print("\nSlowest imports made by mega_dl (cumulative):")
+    for us, name in slowest_imports(script_dir, env, args.top):
+        print(f"  {us / 1000:>7.1f} ms  {name}")
+    loaded = subprocess.run([sys.executable, "-c", "import sys, mega_dl; print(' '.join(m for m in "
+                             "('tkinter', 'Crypto', 'asyncio', 'aiohttp') if m in sys.modules))"],
+                            cwd=script_dir, env=env, stdout=subprocess.PIPE, text=True).stdout.strip()
+    print(f"\nOptional modules loaded at import: {loaded or 'none'}")
+
+if __name__ == "__main__":
+    main()
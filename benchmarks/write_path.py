@@ -0,0 +1,84 @@
+"""Compare the old 8 KB transfer loop with the tuned write path in mega_dl.
+
+Serves a file from a local HTTP server and downloads it with both loops, reporting
+wall-clock throughput and MB per CPU-second of the downloading thread (per-core
+throughput).
+
+    python benchmarks/write_path.py --size-mb 512 --runs 3
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mega_dl  # noqa: E402
+import requests  # noqa: E402
+
+def serve(payload):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            view = memoryview(payload)
+            for i in range(0, len(view), 1024 * 1024):
+                self.wfile.write(view[i:i + 1024 * 1024])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def legacy(session, url, path, size):
+    with session.get(url, stream=True) as r, open(path, "wb") as f:
+        for chunk in r.iter_content(8192):
+            if chunk:
+                f.write(chunk)
+
+def tuned(session, url, path, size):
+    with session.get(url, stream=True) as r, open(path, "wb", buffering=mega_dl.WRITE_BUFFER) as f:
+        mega_dl.preallocate(f, size, keep_size=True)
+        for chunk in mega_dl.iter_body(r):
+            f.write(chunk)
+
+def measure(loop, session, url, path, size):
+    wall, cpu = time.perf_counter(), time.thread_time()
+    loop(session, url, path, size)
+    wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+    assert os.path.getsize(path) == size
+    os.remove(path)
+    mb = size / 1024 / 1024
+    return mb / wall, mb / max(cpu, 1e-9)
+
+def main():
+    parser = argparse.ArgumentParser(description="Write path benchmark")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    mega_dl.limiter.set_limits(0)
+    size = args.size_mb * 1024 * 1024
+    server = serve(os.urandom(size))
+    url = f"http://127.0.0.1:{server.server_port}/file.bin"
+    session = requests.Session()
+
+    print(f"{'loop':<8} {'MB/s wall':>10} {'MB/cpu-s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "file.bin")
+        for name, loop in (("legacy", legacy), ("tuned", tuned)):
+            results = [measure(loop, session, url, path, size) for _ in range(args.runs)]
+            wall = max(r[0] for r in results)
+            cpu = max(r[1] for r in results)
+            print(f"{name:<8} {wall:>10.1f} {cpu:>10.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,29 @@ import os
 import re
 import sys
 import time
+import json
+import base64
+import struct
+import hashlib
 import queue
+import heapq
 import threading
+import collections
 import requests
 import random
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse
-from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
-import tkinter as tk
-from tkinter import ttk, messagebox
-from mega import Mega
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 import argparse
-import zipfile
+import importlib
+import multiprocessing
+import sqlite3
+import shutil
+import socket
+# tkinter, Crypto (Mega), asyncio, zipfile, ctypes, fcntl, http.server and the process pool are imported
+# where they are used, so headless CLI runs neither pay for them nor need them installed
+asyncio = None
 
 # =============================
 # CONFIGURATION
@@ -21,9 +32,42 @@ import zipfile
 HEADERS = {"User-Agent": "MegaDL/1.0"}
 MAX_WORKERS = min(8, (os.cpu_count() or 4) * 2)
 MAX_RETRIES = 5
-RATE_DELAY = 0.3
-SPEED_LIMIT_KB = 512  # 0 = unlimited
+RATE_DELAY = 0.3  # request spacing a host starts at once it has sent a 429
+SPEED_LIMIT_KB = 0  # total cap, 0 = unlimited; e.g. 512 to keep downloads at 512 KB/s
+HOST_SPEED_LIMIT_KB = 0  # per-host cap on top of the total, 0 = unlimited
+PER_HOST_WORKERS = MAX_WORKERS  # concurrent files per host across all albums
+ASYNC_MAX_IN_FLIGHT = 256  # files in flight with --engine async
+LISTING_WORKERS = 4  # albums listed at the same time
+PENDING_PER_ALBUM = 1024  # listed files waiting for a worker, per album
+CHUNK_SIZE = 64 * 1024  # first read size of every transfer
+MAX_CHUNK_SIZE = 1024 * 1024  # reads grow up to this while data keeps arriving fast
+WRITE_BUFFER = 1024 * 1024  # small writes are coalesced up to this before hitting the disk
+WRITE_BEHIND_MB = 32  # per filesystem: downloaded data waiting for its writer thread before transfers wait
+FSYNC = "never"  # never, close (each finished file, before its rename) or checkpoint (also before resume state is saved)
+FREE_SPACE_MARGIN_MB = 256  # an album only starts if its known sizes fit in the free space beyond this
+SEGMENTS = 4  # parallel byte ranges per large file (1 = single stream)
+SEGMENT_MIN_SIZE = 64 * 1024 * 1024  # only split files at least this big
+ORDER = "listing"  # which waiting file of an album starts next: listing, largest or smallest
+STRAGGLER_MIN_SIZE = 8 * 1024 * 1024  # with ORDER largest, a file this big that outweighs its share of the album is split too
+MEGA_API = "https://g.api.mega.co.nz/cs"
+MEGA_PIECE_SIZE = 8 * 1024 * 1024  # Mega files are fetched as ranges of whole chunks this big, SEGMENTS at a time
+LISTING_TTL = 0  # seconds an album listing is reused from the disk cache, 0 = always re-list
+LISTING_CACHE_MB = 64
+MIRROR_TTL = 3600  # seconds probe results for interchangeable mirrors (Bunkr's) are reused
+MIRROR_SWITCH_RATIO = 4  # a transfer leaves its mirror once another is measured this many times faster
+HASH_ALGO = "sha256"  # hashlib name computed while downloading, "" = off
+REVALIDATE = False  # True = ask the host again instead of trusting the manifest
+STORE_DIR = ""  # content store shared by every album with --store, "" = BASE_DIR/.store
+STORE_LINK = "hardlink"  # how stored files reach an album: hardlink, reflink or copy
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # processes unzipping with --unzip
+EXTRACT_QUEUE = 16  # finished zips waiting for an extract worker before downloads block
+ZIP_MAX_TOTAL = 100 * 1024 ** 3  # refuse archives that expand beyond this
+ZIP_MAX_RATIO = 1000  # or that expand more than this many times their size
 BASE_DIR = "downloads"
+METRICS_INTERVAL = 10  # seconds between --metrics-file lines
+SQLITE_JOURNAL = "WAL"  # manifest and store databases; --worker uses DELETE, which shared network filesystems support
+LEASE_SECONDS = 60  # a --worker's hold on a file or listing, renewed every third of this while it lives
+MAX_LEASES = 3  # a file whose worker died this many times is given up on
 pause_event = threading.Event()
 pause_event.set()
 
@@ -34,541 +78,4218 @@ def safe_name(name):
     name = re.sub(r'[<>:"/\\|?*]', '', name)
     return name.strip() or "Album"
 
+def wait_if_paused():
+    while not pause_event.is_set():
+        time.sleep(0.2)
+
+class RangeNotSupported(Exception):
+    pass
+
+_fallocate = None
+
+def preallocate(f, size, keep_size=False):
+    # Reserve the blocks of a file whose size is known up front. keep_size leaves the
+    # visible length alone, which size-based resume of single-stream .part files
+    # depends on; that needs Linux fallocate(FALLOC_FL_KEEP_SIZE) and is skipped elsewhere.
+    global _fallocate
+    try:
+        if not keep_size:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+            return
+        if _fallocate is None:
+            _fallocate = False
+            if sys.platform.startswith("linux"):
+                try:
+                    import ctypes
+                    _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+                    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+                except (OSError, AttributeError, TypeError):
+                    _fallocate = False
+        offset = f.tell()
+        if _fallocate and size > offset:
+            _fallocate(f.fileno(), 1, offset, size - offset)  # 1 = FALLOC_FL_KEEP_SIZE
+    except OSError:
+        if not keep_size:
+            f.truncate(size)
+
+def iter_body(r):
+    # Yields the response body as memoryviews over one reused buffer (valid until the
+    # next step). Uncompressed bodies are read straight from the connection with
+    # readinto; the read size starts at CHUNK_SIZE and doubles while reads fill quickly,
+    # shrinking again when the link slows down. A low bandwidth cap keeps it small.
+    proxy = getattr(r, "proxy", None)
+    if proxy is None:
+        yield from read_body(r)
+        return
+    # Through a pooled proxy: the body counts toward its load and measured throughput
+    proxy_pool.streaming(proxy, True)
+    started = time.monotonic()
+    received = 0
+    try:
+        for chunk in read_body(r):
+            received += len(chunk)
+            yield chunk
+    finally:
+        proxy_pool.streaming(proxy, False)
+        proxy_pool.observe(proxy, received, time.monotonic() - started)
+
+def read_body(r):
+    encoding = r.headers.get("Content-Encoding", "identity").lower()
+    fp = getattr(r.raw, "_fp", None)
+    if encoding not in ("", "identity") or not hasattr(fp, "readinto"):
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if chunk:
+                yield chunk
+        return
+    top = MAX_CHUNK_SIZE
+    if limiter.total.rate:
+        top = min(top, max(CHUNK_SIZE, int(limiter.total.rate) // 8))
+    view = memoryview(bytearray(max(top, CHUNK_SIZE)))
+    chunk = min(CHUNK_SIZE, top)
+    while True:
+        started = time.monotonic()
+        n = fp.readinto(view[:chunk])
+        if not n:
+            return
+        yield view[:n]
+        took = time.monotonic() - started
+        if n == chunk and took < 0.05 and chunk < top:
+            chunk = min(chunk * 2, top)
+        elif took > 0.5 and chunk > CHUNK_SIZE:
+            chunk //= 2
+
+class StreamHash:
+    # Incremental hash of a .part file, fed as bytes are written. Kept across retries,
+    # so a resumed transfer carries on from where the hash left off; only a .part left
+    # by an earlier run has its prefix read back once.
+    def __init__(self, algo=None):
+        self.algo = HASH_ALGO if algo is None else algo
+        self.h = hashlib.new(self.algo) if self.algo else None
+        self.offset = 0
+
+    def resume(self, path, offset):
+        if self.h is None:
+            return
+        if offset < self.offset:
+            self.h = hashlib.new(self.algo)
+            self.offset = 0
+        if offset > self.offset:
+            with open(path, "rb") as f:
+                f.seek(self.offset)
+                for block in iter(lambda: f.read(min(1024 * 1024, offset - self.offset)), b""):
+                    self.update(block)
+
+    def update(self, chunk):
+        if self.h is not None:
+            self.h.update(chunk)
+            self.offset += len(chunk)
+
+    def hexdigest(self):
+        return self.h.hexdigest() if self.h is not None else None
+
+def expected_digest(key, sha256, seen):
+    # Host-provided hash first; otherwise the manifest's hash, as long as the host
+    # still reports the same validators for the file
+    if HASH_ALGO != "sha256":
+        return None
+    if sha256:
+        return sha256
+    row = manifest.get(key) if key else None
+    if not row or not row["sha256"]:
+        return None
+    same = (seen.get("etag") and seen.get("etag") == row["etag"]) or \
+           (seen.get("last_modified") and seen.get("last_modified") == row["last_modified"])
+    return row["sha256"] if same else None
+
+def local_copy_matches(target):
+    # Check if existing file matches size
+    path, size = target["path"], target["size"]
+    return size > 0 and os.path.exists(path) and os.path.getsize(path) == size
+
+def validators(response):
+    headers = response.headers if response is not None else {}
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+# =============================
+# PROGRESS
+# =============================
+class FileProgress:
+    # Handle a worker feeds for one transfer. Byte counts are batched locally and
+    # pushed to the hub every 256 KB or quarter second, so the shared lock is rare.
+    def __init__(self, hub, entry, owner=True):
+        self.hub = hub
+        self.entry = entry
+        self.owner = owner
+        self.pending = 0
+        self.flushed = time.monotonic()
+
+    def fork(self):
+        # Separate batching for another thread working on the same file (segments)
+        return FileProgress(self.hub, self.entry, owner=False)
+
+    def update(self, n):
+        self.pending += n
+        if self.pending >= 256 * 1024:
+            self.flush()
+        else:
+            now = time.monotonic()
+            if now - self.flushed >= 0.25:
+                self.flush(now)
+
+    def flush(self, now=None):
+        self.flushed = now or time.monotonic()
+        if self.pending:
+            self.hub.add(self.entry, self.pending)
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.owner:
+            self.hub.finish(self.entry)
+
+class Progress:
+    # One place every transfer reports to; the CLI renders a single aggregated line
+    # from it and the GUI polls it from the Tk main loop
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_done = 0
+        self.active = {}  # id -> [name, done, total]
+        self.albums = []
+        self.samples = collections.deque(maxlen=20)
+        self.message = None
+        self.next_id = 0
+
+    def start_file(self, name, total, initial=0):
+        with self.lock:
+            self.next_id += 1
+            self.active[self.next_id] = [name, initial, total]
+            return FileProgress(self, self.next_id)
+
+    def add(self, entry, n):
+        with self.lock:
+            self.bytes_done += n
+            if entry in self.active:
+                self.active[entry][1] += n
+
+    def finish(self, entry):
+        with self.lock:
+            self.active.pop(entry, None)
+
+    def track_album(self, album):
+        with self.lock:
+            self.albums.append(album)
+
+    def untrack_album(self, album):
+        with self.lock:
+            if album in self.albums:
+                self.albums.remove(album)
+
+    def post(self, message):
+        with self.lock:
+            self.message = message
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, self.bytes_done))
+            active = [tuple(v) for v in self.active.values()]
+            albums = [(a.name, a.settled, a.total) for a in self.albums]
+            done = self.bytes_done
+            message, self.message = self.message, None
+        first_time, first_bytes = self.samples[0]
+        rate = (done - first_bytes) / (now - first_time) if now > first_time else 0.0
+        remaining = sum(max(0, total - got) for _, got, total in active if total)
+        known = sum(total for _, _, total in active if total)
+        return {
+            "bytes_done": done,
+            "rate": rate,
+            "eta": remaining / rate if rate > 0 and remaining else None,
+            "active": active,
+            "active_fraction": (known - remaining) / known if known else None,
+            "albums": albums,
+            "message": message,
+        }
+
+def human_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+def progress_line(snap):
+    eta = snap["eta"]
+    parts = [
+        f"{human_size(snap['rate'])}/s",
+        f"{human_size(snap['bytes_done'])} done",
+        f"ETA {int(eta // 60)}m{int(eta % 60):02d}s" if eta is not None else "ETA --",
+        f"{len(snap['active'])} active",
+    ]
+    parts += [f"{name} {done}/{total}" for name, done, total in snap["albums"][:3]]
+    return " | ".join(parts)
+
+progress = Progress()
+
+def cli_status(message):
+    sys.stderr.write("\r\033[K")
+    print(message)
+
+def render_progress(stop, interval=0.5):
+    # Single aggregated status line on stderr instead of one bar per worker
+    tty = sys.stderr.isatty()
+    last_plain = 0.0
+    while not stop.wait(interval):
+        line = progress_line(progress.snapshot())
+        if tty:
+            sys.stderr.write("\r\033[K" + line[:200])
+            sys.stderr.flush()
+        elif time.monotonic() - last_plain >= 10:
+            sys.stderr.write(line + "\n")
+            last_plain = time.monotonic()
+    if tty:
+        sys.stderr.write("\r\033[K")
+
+# =============================
+# METRICS
+# =============================
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRIC_HELP = {
+    "bytes_total": ("counter", "Body bytes received"),
+    "requests_total": ("counter", "HTTP requests sent"),
+    "request_errors_total": ("counter", "Requests that failed before a response"),
+    "throttled_total": ("counter", "429 responses"),
+    "retries_total": ("counter", "Transfer attempts retried"),
+    "gave_up_total": ("counter", "Transfers abandoned after MAX_RETRIES"),
+    "files_total": ("counter", "Files settled, by result"),
+    "proxy_requests_total": ("counter", "Requests per proxy of the --proxy-file pool, by result"),
+    "proxy_bytes_total": ("counter", "Body bytes received per proxy"),
+    "mirror_failovers_total": ("counter", "Transfers moved off a failed or slow mirror, by mirror left"),
+    "store_linked_bytes_total": ("counter", "Bytes placed from the content store instead of downloaded"),
+    "disk_bytes_total": ("counter", "Bytes written by the writer thread of each filesystem"),
+    "disk_busy_seconds_total": ("counter", "Time each filesystem's writer thread spent writing, syncing and closing"),
+    "disk_stall_seconds_total": ("counter", "Time transfers waited on a full write-behind buffer: the disk, not the network, held them up"),
+    "ttfb_seconds": ("histogram", "Time from sending a request to its response headers"),
+    "transfer_seconds": ("histogram", "Wall time per file, probe to rename"),
+    "queue_pending_files": ("gauge", "Listed files waiting for a worker"),
+    "in_flight_files": ("gauge", "Files being transferred"),
+    "queued_albums": ("gauge", "Album URLs waiting to be listed"),
+    "host_concurrency_limit": ("gauge", "Concurrency the host's rate controller allows"),
+    "disk_queued_bytes": ("gauge", "Downloaded bytes waiting for a writer thread"),
+}
+
+class Metrics:
+    # Counters and histograms are updated per request or per file, never per chunk,
+    # so one lock is enough. Gauges are callbacks evaluated only when collected.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+        self.last_bytes = ({}, time.monotonic())
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                # Per-bucket counts plus +Inf, sum and count
+                hist = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            else:
+                hist[len(LATENCY_BUCKETS)] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def gauge(self, name, fn):
+        # fn returns a number, or a {label_value: number} dict labelled by host
+        self.gauges[name] = fn
+
+    def _gauge_values(self):
+        values = {}
+        for name, fn in self.gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:
+                continue
+        return values
+
+    def prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        lines, typed = [], set()
+
+        def series(name, labels):
+            if name not in typed:
+                typed.add(name)
+                kind, text = METRIC_HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP megadl_{name} {text}")
+                lines.append(f"# TYPE megadl_{name} {kind}")
+            return ",".join(f'{k}="{v}"' for k, v in labels)
+
+        for (name, labels), value in counters:
+            tags = series(name, labels)
+            lines.append(f"megadl_{name}{{{tags}}} {value:.17g}")
+        for (name, labels), hist in histograms:
+            tags = series(name, labels)
+            sep = "," if tags else ""
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), hist):
+                cumulative += count
+                lines.append(f'megadl_{name}_bucket{{{tags}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f"megadl_{name}_sum{{{tags}}} {hist[-2]:.6f}")
+            lines.append(f"megadl_{name}_count{{{tags}}} {hist[-1]}")
+        for name, value in sorted(self._gauge_values().items()):
+            series(name, ())
+            if isinstance(value, dict):
+                lines.extend(f'megadl_{name}{{host="{host}"}} {v:.17g}' for host, v in sorted(value.items()))
+            else:
+                lines.append(f"megadl_{name} {value:.17g}")
+        return "\n".join(lines) + "\n"
+
+    def json_line(self):
+        # One self-contained record: counters, histogram sum/count/buckets, gauges,
+        # and per-host bytes/s since the previous line
+        now = time.monotonic()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        host_bytes = {dict(labels).get("host"): value
+                      for (name, labels), value in counters.items() if name == "bytes_total"}
+        previous, since = self.last_bytes
+        self.last_bytes = (host_bytes, now)
+        elapsed = max(now - since, 1e-6)
+
+        def flat(name, labels):
+            return name + "".join(f"|{k}={v}" for k, v in labels)
+
+        return json.dumps({
+            "time": time.time(),
+            "counters": {flat(*k): v for k, v in counters.items()},
+            "histograms": {flat(*k): {"count": h[-1], "sum": round(h[-2], 6),
+                                      "buckets": h[:len(LATENCY_BUCKETS) + 1]}
+                           for k, h in histograms.items()},
+            "gauges": self._gauge_values(),
+            "host_bytes_per_second": {host: round((b - previous.get(host, 0)) / elapsed, 1)
+                                      for host, b in host_bytes.items()},
+        })
+
+metrics = Metrics()
+
+def serve_metrics(port, host="127.0.0.1"):
+    import http.server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def dump_metrics(path, stop, interval=METRICS_INTERVAL):
+    # Appends a JSON line every interval, plus a last one when stopped
+    while True:
+        stopped = stop.wait(interval)
+        with open(path, "a") as f:
+            f.write(metrics.json_line() + "\n")
+        if stopped:
+            return
+
+# =============================
+# TRACING
+# =============================
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+NO_SPAN = NoSpan()
+
+class Span:
+    __slots__ = ("tracer", "name", "cat", "track", "args", "start")
+
+    def __init__(self, tracer, name, cat, track, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.track = track
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.complete(self.name, self.cat, self.start, track=self.track, args=self.args)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    # --trace: timed spans per phase, saved as Chrome/Perfetto trace JSON. Spans on one
+    # thread nest as slices of that thread; spans given a track (album runs, asyncio
+    # tasks, unzips) cross threads, so they become async slices keyed by the track.
+    # Disabled, span() hands back a shared no-op object.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = set()
+        self.origin = time.perf_counter()
+
+    def start(self):
+        self.origin = time.perf_counter()
+        self.enabled = True
+
+    def span(self, name, cat="file", track=None, **args):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, cat, track, args)
+
+    def complete(self, name, cat, start, end=None, track=None, args=None):
+        if not self.enabled:
+            return
+        end = end or time.perf_counter()
+        ts = (start - self.origin) * 1e6
+        dur = (end - start) * 1e6
+        pid, tid = os.getpid(), threading.get_ident()
+        with self.lock:
+            if tid not in self.threads:
+                self.threads.add(tid)
+                self.events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            if track is None:
+                self.events.append({"ph": "X", "name": name, "cat": cat, "ts": ts, "dur": dur,
+                                    "pid": pid, "tid": tid, "args": args or {}})
+            else:
+                event = {"name": name, "cat": cat, "id": str(track), "pid": pid, "tid": tid}
+                self.events.append(dict(event, ph="b", ts=ts, args=args or {}))
+                self.events.append(dict(event, ph="e", ts=ts + dur))
+
+    def save(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+tracer = Tracer()
+
+# =============================
+# HTTP SESSIONS
+# =============================
+class SessionPool:
+    # One keep-alive requests.Session per host, shared by every adapter and worker thread
+    def __init__(self, pool_size=MAX_WORKERS):
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pool_size):
+        with self._lock:
+            if pool_size == self.pool_size:
+                return
+            self.pool_size = pool_size
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def get(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def stats(self):
+        # {host: (requests, connections opened)}; requests - connections = reused
+        with self._lock:
+            sessions = list(self._sessions.items())
+        stats = {}
+        for host, session in sessions:
+            sent = opened = 0
+            for adapter in set(session.adapters.values()):
+                managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+                for manager in managers:
+                    for key in list(manager.pools.keys()):
+                        pool = manager.pools.get(key)
+                        if pool is not None:
+                            sent += pool.num_requests
+                            opened += pool.num_connections
+            stats[host] = (sent, opened)
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        sent = sum(s for s, _ in stats.values())
+        opened = sum(o for _, o in stats.values())
+        return f"{sent} requests over {opened} connections ({max(0, sent - opened)} reused) across {len(stats)} hosts"
+
+sessions = SessionPool()
+
+# =============================
+# BANDWIDTH LIMITER
+# =============================
+class TokenBucket:
+    def __init__(self, rate_kb):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.set_rate(rate_kb)
+
+    def set_rate(self, rate_kb):
+        with self.lock:
+            self.rate = max(0, rate_kb) * 1024
+            # Allow roughly a quarter second of burst, never less than a few chunks
+            self.capacity = max(self.rate / 4, 64 * 1024)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def consume(self, n):
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, n):
+        # Callers reserve their bytes up front and sleep off any debt, so concurrent
+        # threads are served in order and the aggregate never exceeds the rate.
+        # Returns how long the caller has to wait.
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+class BandwidthLimiter:
+    # One total bucket shared by every worker and album, plus optional per-host buckets
+    def __init__(self, total_kb=SPEED_LIMIT_KB, per_host_kb=HOST_SPEED_LIMIT_KB):
+        self.total = TokenBucket(total_kb)
+        self.per_host_kb = per_host_kb
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def set_limits(self, total_kb=None, per_host_kb=None):
+        if total_kb is not None:
+            self.total.set_rate(total_kb)
+        if per_host_kb is not None:
+            with self.lock:
+                self.per_host_kb = per_host_kb
+                for bucket in self.hosts.values():
+                    bucket.set_rate(per_host_kb)
+
+    def throttle(self, host, n):
+        delay = self.delay(host, n)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def delay(self, host, n):
+        wait = 0.0
+        if self.per_host_kb > 0:
+            with self.lock:
+                bucket = self.hosts.get(host)
+                if bucket is None:
+                    bucket = self.hosts[host] = TokenBucket(self.per_host_kb)
+            wait = bucket.reserve(n)
+        return max(wait, self.total.reserve(n))
+
+limiter = BandwidthLimiter()
+
+# =============================
+# DISK
+# =============================
+class DiskWriter:
+    # One thread per filesystem doing the writes of every transfer to it, so a slow disk
+    # or network mount holds up its writer instead of the socket reads. Transfers queue
+    # copies of their data and carry on; once WRITE_BEHIND_MB is waiting they wait too,
+    # counted in disk_stall_seconds_total: the disk, not the network, is the bottleneck.
+    def __init__(self, device):
+        self.device = device
+        self.cond = threading.Condition()
+        self.ops = collections.deque()
+        self.queued = 0
+        self.busy = 0.0
+        self.stalled = 0.0
+        self.written = 0
+        threading.Thread(target=self._run, name=f"disk-{device}", daemon=True).start()
+
+    def submit(self, handle, op, nbytes=0, always=False):
+        limit = WRITE_BEHIND_MB * 1024 * 1024
+        with self.cond:
+            if self.queued and self.queued + nbytes > limit:
+                started = time.monotonic()
+                with tracer.span("write-behind full", "wait", device=self.device):
+                    while self.queued and self.queued + nbytes > limit:
+                        self.cond.wait()
+                waited = time.monotonic() - started
+                self.stalled += waited
+                metrics.inc("disk_stall_seconds_total", waited, device=self.device)
+            self.queued += nbytes
+            handle.outstanding += 1
+            self.ops.append((handle, op, nbytes, always))
+            self.cond.notify_all()
+
+    def wait(self, handle):
+        with self.cond:
+            while handle.outstanding:
+                self.cond.wait()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.ops:
+                    self.cond.wait()
+                handle, op, nbytes, always = self.ops.popleft()
+            started = time.monotonic()
+            # After a failed write the rest of the file's writes are dropped; its close still runs
+            if handle.error is None or always:
+                try:
+                    op(handle.f)
+                except Exception as e:
+                    handle.error = handle.error or e
+            took = time.monotonic() - started
+            with self.cond:
+                self.queued -= nbytes
+                self.busy += took
+                self.written += nbytes
+                handle.outstanding -= 1
+                self.cond.notify_all()
+            metrics.inc("disk_busy_seconds_total", took, device=self.device)
+            if nbytes:
+                metrics.inc("disk_bytes_total", nbytes, device=self.device)
+
+class DiskWriters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writers = {}
+        self.started = time.monotonic()
+
+    def get(self, path):
+        device = os.stat(os.path.dirname(os.path.abspath(path))).st_dev
+        with self.lock:
+            if device not in self.writers:
+                self.writers[device] = DiskWriter(device)
+            return self.writers[device]
+
+    def summary(self):
+        # Busy share of each writer since the start, and how long transfers waited for it
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            writers = list(self.writers.values())
+        return ", ".join(
+            f"device {w.device}: {human_size(w.written)} written, busy {w.busy / elapsed:.0%}, "
+            f"transfers waited {w.stalled:.1f}s" + (" (disk-bound)" if w.stalled > 0.05 * elapsed else "")
+            for w in writers
+        )
+
+disk_writers = DiskWriters()
+
+class WriteBehindFile:
+    # What the transfer loops write through: write() copies the data into a buffer that
+    # goes to the filesystem's writer every WRITE_BUFFER bytes, flush() and close() wait
+    # until everything is written and raise the first error the writer hit. FSYNC
+    # decides which of them also sync. Opened right away, so a bad path fails where
+    # open() would.
+    def __init__(self, path, mode):
+        self.f = open(path, mode, buffering=WRITE_BUFFER)
+        self.writer = disk_writers.get(path)
+        self.buf = bytearray()
+        self.error = None
+        self.outstanding = 0
+        self.closed = False
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _push(self):
+        if self.buf:
+            data, self.buf = self.buf, bytearray()
+            self.writer.submit(self, lambda f: f.write(data), len(data))
+
+    def write(self, data):
+        self._check()
+        self.buf += data  # A copy: the transfer loops reuse their buffers
+        if len(self.buf) >= WRITE_BUFFER:
+            self._push()
+
+    def seek(self, offset):
+        self._push()
+        self.writer.submit(self, lambda f: f.seek(offset))
+
+    def preallocate(self, size, keep_size=False):
+        self._push()
+        self.writer.submit(self, lambda f: preallocate(f, size, keep_size))
+
+    def full(self):
+        # Whether the next write() may wait for the writer
+        pending = len(self.buf) + CHUNK_SIZE
+        return pending >= WRITE_BUFFER and self.writer.queued + pending > WRITE_BEHIND_MB * 1024 * 1024
+
+    def flush(self):
+        # A checkpoint: what was written so far is in the file before resume state records it
+        def flush(f):
+            f.flush()
+            if FSYNC == "checkpoint":
+                os.fsync(f.fileno())
+        self._push()
+        self.writer.submit(self, flush)
+        self.writer.wait(self)
+        self._check()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.error is None:
+            self._push()
+
+        def close(f):
+            try:
+                if self.error is None:
+                    f.flush()
+                    if FSYNC != "never":
+                        os.fsync(f.fileno())
+            finally:
+                f.close()
+        self.writer.submit(self, close, always=True)
+        self.writer.wait(self)
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception as e:
+            if e is not exc:
+                # The writer failed too: data the transfer counted as written is not in
+                # the file, which whoever resumes it has to know
+                raise e from exc
+
+class DiskSpace:
+    # Free-space admission. Files with a known size are only handed to an engine once
+    # the bytes they still need fit in the filesystem's free space, less
+    # FREE_SPACE_MARGIN_MB and what files admitted earlier and not yet settled still need.
+    # A file's reservation is held until it settles, so one being written counts twice
+    # for a while; that errs on the side of not filling the disk.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reserved = collections.Counter()  # device -> bytes
+
+    def needs(self, album, files):
+        # {file key: bytes still to write} for the files of known size not admitted yet
+        need = {}
+        for file in files:
+            key = album.adapter.file_key(file)
+            size = album.size_of(file)
+            if not size or key in album.reserved:
+                continue
+            path = os.path.join(album.output_dir, file["name"])
+            have = max(file_size(path), file_size(path + ".part"))
+            need[key] = max(0, size - have)
+        return need
+
+    def admit(self, album, files):
+        # Returns 0 when the files are admitted, otherwise how many bytes are missing
+        need = self.needs(album, files)
+        total = sum(need.values())
+        if not total:
+            return 0
+        device = os.stat(album.output_dir).st_dev
+        free = shutil.disk_usage(album.output_dir).free
+        with self.lock:
+            short = total + self.reserved[device] + FREE_SPACE_MARGIN_MB * 1024 * 1024 - free
+            if short > 0:
+                return short
+            self.reserved[device] += total
+            album.reserved.update(need)
+            album.device = device
+        return 0
+
+    def settle(self, album, file, result):
+        # on_file callback: the file's reservation is now on disk or not needed
+        if album.device is None:
+            return
+        with self.lock:
+            self.reserved[album.device] -= album.reserved.pop(album.adapter.file_key(file), 0)
+
+    def release(self, album):
+        # What is left once the album is over: files skipped by the manifest or cancelled
+        if album.device is None:
+            return
+        with self.lock:
+            self.reserved[album.device] -= sum(album.reserved.values())
+            album.reserved.clear()
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+disk_space = DiskSpace()
+
+# =============================
+# ADAPTIVE RATE CONTROL
+# =============================
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class HostController:
+    # AIMD per host, shared by all workers: a 429 halves the allowed concurrency,
+    # doubles the spacing between requests and blocks the host until Retry-After.
+    # Every PROBE_AFTER clean responses one worker and some spacing are given back.
+    PROBE_AFTER = 20
+
+    def __init__(self, host, max_concurrency):
+        self.host = host
+        self.lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.interval = 0.0
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.successes = 0
+        self.throttled = 0
+
+    def limit(self):
+        with self.lock:
+            return max(1, int(self.concurrency))
+
+    def blocked_for(self):
+        with self.lock:
+            return self.blocked_until - time.monotonic()
+
+    def before_request(self):
+        delay = self.reserve()
+        if delay > 0:
+            held = self.blocked_until > time.monotonic()
+            with tracer.span("429 hold" if held else "request spacing", "wait", host=self.host):
+                time.sleep(delay)
+
+    def reserve(self):
+        # Claims the next request slot; returns how long to wait for it
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot, self.blocked_until)
+            self.next_slot = start + self.interval
+        return start - now
+
+    def on_success(self):
+        with self.lock:
+            self.backoff = 0.0
+            self.successes += 1
+            if self.successes < self.PROBE_AFTER:
+                return
+            self.successes = 0
+            if self.concurrency < self.max_concurrency:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.interval = self.interval * 0.75 if self.interval > 0.02 else 0.0
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self.successes = 0
+            self.backoff = min(120.0, max(5.0, self.backoff * 2))
+            wait = retry_after if retry_after is not None else self.backoff + random.uniform(0, 2)
+            # 429s from requests that were already in flight belong to the same burst
+            if now >= self.blocked_until:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.interval = max(RATE_DELAY, self.interval * 2)
+            self.blocked_until = max(self.blocked_until, now + wait)
+            return self.blocked_until - now
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "concurrency": max(1, int(self.concurrency)),
+                "interval": round(self.interval, 3),
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+                "throttled": self.throttled,
+            }
+
+class RateControl:
+    def __init__(self, max_concurrency=PER_HOST_WORKERS):
+        self.max_concurrency = max_concurrency
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        with self.lock:
+            ctl = self.hosts.get(host)
+            if ctl is None:
+                ctl = self.hosts[host] = HostController(host, self.max_concurrency or MAX_WORKERS)
+            return ctl
+
+    def limit(self, host):
+        # Files a host may have in flight: its controller's limit, or with a proxy pool
+        # the sum over the routes through every ready proxy
+        if proxy_pool.proxies:
+            return sum(self.get(proxy_pool.route(p, host)).limit() for p in proxy_pool.ready()) or 1
+        return self.get(host).limit()
+
+    def snapshot(self):
+        with self.lock:
+            hosts = list(self.hosts.items())
+        return {host: ctl.snapshot() for host, ctl in hosts}
+
+    def summary(self):
+        return ", ".join(
+            f"{host}: {st['concurrency']} workers, {st['interval']}s spacing, {st['throttled']}x 429"
+            for host, st in self.snapshot().items()
+        ) or "no hosts contacted"
+
+rate_control = RateControl()
+
+# =============================
+# PROXY POOL
+# =============================
+class Proxy:
+    def __init__(self, url):
+        self.url = url
+        self.rate = 0.0  # moving average of body bytes/s per transfer
+        self.errors = 0.0  # moving average share of requests that failed or got a 429
+        self.failures = 0  # in a row
+        self.cooldown = 0.0
+        self.cooldown_until = 0.0
+        self.active = 0  # requests waiting for headers plus bodies being read
+
+class ProxyPool:
+    # Proxies loaded with --proxy-file. Each request goes to the better of two random
+    # ready proxies, scored by measured throughput, error and 429 share and current
+    # load. Rate control runs per proxy and host, so each proxy's IP gets its own
+    # share of a host's limits. A proxy failing COOLDOWN_AFTER times in a row rests
+    # for a cooldown that doubles each time, then is tried again.
+    COOLDOWN_AFTER = 3
+    FAILOVER = 3  # proxies tried per request
+    ALPHA = 0.2
+
+    def __init__(self):
+        self.proxies = []
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        with open(path, "r") as f:
+            urls = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        self.proxies = [Proxy(url if "://" in url else f"http://{url}") for url in urls]
+        return len(self.proxies)
+
+    def route(self, proxy, host):
+        # Rate-control key: the host itself without a pool
+        return host if proxy is None else f"{host} via {proxy.url}"
+
+    def ready(self):
+        now = time.monotonic()
+        with self.lock:
+            return [p for p in self.proxies if p.cooldown_until <= now]
+
+    def pick(self, host, tried=()):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [p for p in self.proxies if p not in tried] or self.proxies
+            healthy = [p for p in candidates if p.cooldown_until <= now]
+            if not healthy:
+                healthy = [min(candidates, key=lambda p: p.cooldown_until)]
+            # Routes to this host still held by a 429 only if nothing else is free
+            free = [p for p in healthy if rate_control.get(self.route(p, host)).blocked_for() <= 0] or healthy
+            best_rate = max([p.rate for p in self.proxies] + [1.0])
+            # Unmeasured proxies count as good as the best one, so each gets tried
+            proxy = max(random.sample(free, min(2, len(free))),
+                        key=lambda p: (p.rate or best_rate) * (1 - p.errors) / (1 + p.active))
+            proxy.active += 1
+        return proxy
+
+    def release(self, proxy, ok, throttled=False):
+        # Called once a request has its headers, or has failed
+        if proxy is None:
+            return
+        result = "throttled" if throttled else "ok" if ok else "error"
+        metrics.inc("proxy_requests_total", proxy=proxy.url, result=result)
+        with self.lock:
+            proxy.active -= 1
+            proxy.errors += self.ALPHA * ((0.0 if ok and not throttled else 1.0) - proxy.errors)
+            if ok or throttled:
+                # A 429 is the host's verdict on the route; rate control deals with it
+                proxy.failures = 0
+                proxy.cooldown = 0.0
+                return
+            proxy.failures += 1
+            if proxy.failures >= self.COOLDOWN_AFTER:
+                proxy.failures = 0
+                proxy.cooldown = min(600.0, max(30.0, proxy.cooldown * 2))
+                proxy.cooldown_until = time.monotonic() + proxy.cooldown
+                print(f"\n⚠ Proxy {proxy.url} keeps failing, resting it for {proxy.cooldown:.0f}s")
+
+    def failover(self, tried):
+        # Whether a request a proxy could not carry should go out through another one
+        return len(tried) < min(self.FAILOVER, len(self.proxies))
+
+    def streaming(self, proxy, started):
+        if proxy is not None:
+            with self.lock:
+                proxy.active += 1 if started else -1
+
+    def observe(self, proxy, nbytes, seconds):
+        # Throughput of one body; small bodies measure latency more than bandwidth
+        if proxy is None:
+            return
+        metrics.inc("proxy_bytes_total", nbytes, proxy=proxy.url)
+        if nbytes < 256 * 1024 or seconds <= 0:
+            return
+        with self.lock:
+            rate = nbytes / seconds
+            proxy.rate = rate if not proxy.rate else proxy.rate + self.ALPHA * (rate - proxy.rate)
+
+    def summary(self):
+        now = time.monotonic()
+        with self.lock:
+            return ", ".join(
+                f"{p.url}: {human_size(p.rate)}/s, {p.errors:.0%} errors"
+                + (f", resting {p.cooldown_until - now:.0f}s" if p.cooldown_until > now else "")
+                for p in self.proxies
+            )
+
+proxy_pool = ProxyPool()
+
+# =============================
+# LISTING CACHE
+# =============================
+class ListingCache:
+    # On-disk album listings under BASE_DIR/.cache, reused for LISTING_TTL seconds and
+    # evicted least-recently-used once the directory grows past max_mb
+    def __init__(self, ttl=LISTING_TTL, max_mb=LISTING_CACHE_MB):
+        self.ttl = ttl
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(BASE_DIR, ".cache", "listings", hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            if time.time() - entry["stored"] > self.ttl:
+                return None
+            os.utime(path)  # Mark as recently used for eviction
+            return entry["data"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, data):
+        if self.ttl <= 0:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            with open(path + ".tmp", "w") as f:
+                json.dump({"key": key, "stored": time.time(), "data": data}, f)
+            os.replace(path + ".tmp", path)
+            self._evict(os.path.dirname(path))
+
+    def _evict(self, directory):
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+listing_cache = ListingCache()
+
+# =============================
+# MIRRORS
+# =============================
+class MirrorSwitch(Exception):
+    # The transfer should resume on another mirror right away, without a retry backoff
+    pass
+
+class Mirror:
+    def __init__(self, domain):
+        self.domain = domain
+        self.latency = 0.0  # seconds to the response headers
+        self.rate = 0.0  # bytes/s of one connection, 0 = not measured
+        self.probed = 0.0  # wall time of the last probe
+        self.failures = 0  # in a row
+        self.down_until = 0.0  # wall time
+
+class MirrorSet:
+    # Domains serving the same paths, so any URL on one can be fetched from the others.
+    # The first URL asked for is probed on every mirror for latency and throughput,
+    # and the results are kept in BASE_DIR/.cache/mirrors.json for MIRROR_TTL. Transfers
+    # go to the mirror expected to fetch a typical file soonest and feed their own
+    # measurements back; a mirror that fails rests, doubling while it keeps failing.
+    # Domains matching DISCOVER seen in listed links join the set and are remembered
+    # in the same cache.
+    PROBE_BYTES = 1024 * 1024
+    PROBE_TIMEOUT = 10
+    TYPICAL_FILE = 4 * 1024 * 1024
+    DOWN_FOR = 60.0
+    ALPHA = 0.2
+
+    def __init__(self, name, domains, discover=None):
+        self.name = name
+        self.domains = domains  # by reference, like the adapter routes
+        self.discover = discover  # regex whose group 1 is a mirror domain in a netloc
+        self.mirrors = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.probe_lock = threading.Lock()
+
+    def _path(self):
+        return os.path.join(BASE_DIR, ".cache", "mirrors.json")
+
+    def domain_of(self, url):
+        netloc = urlparse(url).netloc
+        return next((d for d in self.domains if host_matches(netloc, d)), None)
+
+    def on(self, url, domain):
+        # The same URL on another mirror: files.bunkr.si/x -> files.bunkr.fi/x
+        parsed = urlparse(url)
+        current = self.domain_of(url)
+        if current is None or current == domain:
+            return url
+        return parsed._replace(netloc=parsed.netloc[:-len(current)] + domain).geturl()
+
+    def _mirror(self, domain):
+        if domain not in self.mirrors:
+            self.mirrors[domain] = Mirror(domain)
+        return self.mirrors[domain]
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self._path(), "r") as f:
+                saved = json.load(f).get(self.name, {})
+        except (OSError, ValueError):
+            return
+        for domain, data in saved.items():
+            if domain not in self.domains and self.discover and re.search(self.discover, domain):
+                self.domains.append(domain)
+            mirror = self._mirror(domain)
+            for field in ("latency", "rate", "probed", "down_until"):
+                setattr(mirror, field, float(data.get(field, 0.0)))
+
+    def _save(self):
+        path = self._path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with open(path, "r") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+            with self.lock:
+                saved[self.name] = {m.domain: {"latency": m.latency, "rate": m.rate, "probed": m.probed,
+                                               "down_until": m.down_until} for m in self.mirrors.values()}
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(saved, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # The cache is only an optimisation
+
+    def _probe_one(self, url, get):
+        # Time to the headers and throughput of the first PROBE_BYTES of the body. The
+        # first read is left out of the rate: it is whatever the server sent in one go.
+        mirror = self._mirror(self.domain_of(url))
+        headers = HEADERS.copy()
+        headers["Range"] = f"bytes=0-{self.PROBE_BYTES - 1}"
+        started = time.monotonic()
+        try:
+            with get(url, headers=headers, stream=True, timeout=self.PROBE_TIMEOUT) as r:
+                r.raise_for_status()
+                latency = time.monotonic() - started
+                received = first = 0
+                for chunk in read_body(r):
+                    if not first:
+                        first, began = len(chunk), time.monotonic()
+                    received += len(chunk)
+                    if received >= self.PROBE_BYTES:
+                        break
+                took = time.monotonic() - began if first else 0
+                received -= first
+        except Exception as e:
+            if self.at_fault(e):
+                self.failed(url)
+            else:
+                # The probed file is the problem (deleted, throttled): without a stamp every
+                # pick() would probe this mirror again, so it gets another try in DOWN_FOR
+                with self.lock:
+                    mirror.probed = time.time() - MIRROR_TTL + self.DOWN_FOR
+            return
+        with self.lock:
+            mirror.latency = latency
+            if received >= self.PROBE_BYTES // 4 and took > 0:
+                mirror.rate = received / took
+            mirror.probed = time.time()
+            mirror.failures = 0
+            mirror.down_until = 0.0
+
+    def probe(self, url, get):
+        # Probes every mirror without a fresh measurement, in parallel; other callers
+        # wait for the result instead of probing again
+        with self.probe_lock:
+            self._load()
+            now = time.time()
+            stale = [d for d in self.domains
+                     if now - self._mirror(d).probed > MIRROR_TTL and self._mirror(d).down_until <= now]
+            if not stale:
+                return
+            with tracer.span("mirror probe", "listing", mirrors=len(stale)):
+                with ThreadPoolExecutor(max_workers=len(stale), thread_name_prefix="probe") as ex:
+                    list(ex.map(lambda d: self._probe_one(self.on(url, d), get), stale))
+            self._save()
+            print(f"\nMirrors: {self.summary()}")
+
+    def _cost(self, mirror, best_rate):
+        # Expected seconds to fetch a typical file; unmeasured throughput counts as the best
+        return mirror.latency + self.TYPICAL_FILE / (mirror.rate or best_rate)
+
+    def ranked(self, url, exclude=()):
+        # Mirrors of url fastest first, resting ones last; url's own first among equals
+        own = self.domain_of(url)
+        now = time.time()
+        with self.lock:
+            mirrors = [self._mirror(d) for d in self.domains if d not in exclude]
+            best_rate = max([m.rate for m in mirrors] + [1.0])
+            mirrors.sort(key=lambda m: (m.down_until > now, self._cost(m, best_rate), m.domain != own))
+        return [m.domain for m in mirrors]
+
+    def pick(self, url, get):
+        if self.domain_of(url) is None:
+            return url
+        self.probe(url, get)
+        return self.best(url)
+
+    def learn(self, url):
+        # Adds url's domain to the set when it matches DISCOVER and is new
+        if not self.discover or self.domain_of(url) is not None:
+            return
+        m = re.search(self.discover, urlparse(url).netloc)
+        if m is None:
+            return
+        with self.lock:
+            if m.group(1) in self.domains:
+                return
+            self.domains.append(m.group(1))
+        print(f"\nMirrors: found {m.group(1)}")
+
+    def best(self, url):
+        # url on the best mirror known so far, without probing
+        if self.domain_of(url) is None:
+            return url
+        return self.on(url, self.ranked(url)[0])
+
+    def failed(self, url):
+        domain = self.domain_of(url)
+        if domain is None:
+            return
+        with self.lock:
+            mirror = self._mirror(domain)
+            mirror.failures += 1
+            mirror.down_until = time.time() + min(600.0, self.DOWN_FOR * 2 ** (mirror.failures - 1))
+        self._save()
+
+    def healthy_other(self, url):
+        # Fastest mirror of url other than its own that is not resting, or None
+        others = self.ranked(url, exclude=(self.domain_of(url),))
+        if others and self.mirrors[others[0]].down_until <= time.time():
+            return others[0]
+        return None
+
+    def at_fault(self, error):
+        # Connection errors, timeouts and 5xx are the mirror's. A 4xx is about the file
+        # (deleted, forbidden) or the client and would be the same on every mirror; a 429
+        # is the rate controller's business.
+        response = getattr(error, "response", None)
+        status = getattr(error, "status", None) or getattr(response, "status_code", None)
+        return not (isinstance(status, int) and 400 <= status < 500)
+
+    def fail_over(self, url, error):
+        # Rests url's mirror after a failed attempt and raises MirrorSwitch when another
+        # can take over
+        if isinstance(error, (MirrorSwitch, RangeNotSupported)) or self.domain_of(url) is None:
+            return
+        if not self.at_fault(error):
+            return
+        self.failed(url)
+        other = self.healthy_other(url)
+        if other is not None:
+            metrics.inc("mirror_failovers_total", mirror=self.domain_of(url))
+            raise MirrorSwitch(f"{self.domain_of(url)} failed ({error}), resuming on {other}") from error
+
+    def observe(self, url, nbytes, seconds):
+        # Throughput of a finished transfer; small bodies measure latency more than bandwidth
+        if nbytes < 256 * 1024 or seconds <= 0 or self.domain_of(url) is None:
+            return
+        with self.lock:
+            mirror = self._mirror(self.domain_of(url))
+            rate = nbytes / seconds
+            mirror.rate = rate if not mirror.rate else mirror.rate + self.ALPHA * (rate - mirror.rate)
+            mirror.failures = 0
+
+    def faster(self, url, rate):
+        # A healthy mirror measured MIRROR_SWITCH_RATIO times faster than rate, or None
+        other = self.healthy_other(url)
+        if other is None or self.mirrors[other].rate <= rate * MIRROR_SWITCH_RATIO:
+            return None
+        return other
+
+    def left(self, url, rate):
+        # A transfer gave up on url's mirror at rate; the mirror takes on that rate, so
+        # new transfers avoid it too
+        with self.lock:
+            self._mirror(self.domain_of(url)).rate = rate
+        metrics.inc("mirror_failovers_total", mirror=self.domain_of(url))
+
+    def watch(self, url):
+        return MirrorWatch(self, url) if self.domain_of(url) is not None else None
+
+    def summary(self):
+        now = time.time()
+        with self.lock:
+            return ", ".join(
+                f"{m.domain}: {m.latency * 1000:.0f}ms, {human_size(m.rate)}/s"
+                + (f", resting {m.down_until - now:.0f}s" if m.down_until > now else "")
+                for m in sorted(self.mirrors.values(), key=lambda m: m.domain) if m.domain in self.domains
+            )
+
+class MirrorWatch:
+    # Follows one transfer in windows of WINDOW seconds of network time (time spent in
+    # the bandwidth limiter does not count). Two slow windows in a row while another
+    # mirror is measured MIRROR_SWITCH_RATIO times faster raise MirrorSwitch; the .part
+    # resumes there with a Range request.
+    WINDOW = 3.0
+
+    def __init__(self, mirrors, url):
+        self.mirrors = mirrors
+        self.url = url
+        self.started = self.since = time.monotonic()
+        self.received = 0
+        self.window_bytes = 0
+        self.waited = 0.0
+        self.slow = 0
+
+    def update(self, n, waited=0.0):
+        self.received += n
+        self.window_bytes += n
+        self.waited += waited
+        now = time.monotonic()
+        elapsed = now - self.since
+        if elapsed < self.WINDOW:
+            return
+        busy = elapsed - self.waited
+        rate = self.window_bytes / busy if busy > 0 else 0.0
+        self.since, self.window_bytes, self.waited = now, 0, 0.0
+        if elapsed > 4 * self.WINDOW or busy < self.WINDOW / 3:
+            # Paused, or held back by the limiter: nothing to judge the mirror by
+            self.slow = 0
+            return
+        other = self.mirrors.faster(self.url, rate)
+        self.slow = self.slow + 1 if other else 0
+        if self.slow < 2:
+            return
+        self.mirrors.left(self.url, rate)
+        raise MirrorSwitch(f"{self.mirrors.domain_of(self.url)} slowed to {human_size(rate)}/s, "
+                           f"resuming on {other}")
+
+    def done(self):
+        self.mirrors.observe(self.url, self.received, time.monotonic() - self.started)
+
+# =============================
+# DOWNLOAD MANIFEST
+# =============================
+class Manifest:
+    # SQLite record of every completed file, so skip decisions for a whole album are
+    # one batch lookup instead of a HEAD request per file
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.db_path = None
+
+    def _db(self):
+        path = os.path.join(BASE_DIR, ".manifest.sqlite")
+        if self.conn is None or self.db_path != path:
+            os.makedirs(BASE_DIR, exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL}")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "key TEXT PRIMARY KEY, path TEXT, size INTEGER, etag TEXT, "
+                "last_modified TEXT, sha256 TEXT, completed_at REAL)"
+            )
+            self.db_path = path
+        return self.conn
+
+    def record(self, key, path, size, etag=None, last_modified=None, sha256=None):
+        with self.lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, path, size, etag, last_modified, sha256, time.time())
+            )
+            db.commit()
+
+    def get(self, key):
+        return self.lookup([key]).get(key)
+
+    def lookup(self, keys):
+        # {key: row dict} for the keys that have a completed entry
+        rows = {}
+        keys = list(keys)
+        with self.lock:
+            db = self._db()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                cur = db.execute(
+                    "SELECT key, path, size, etag, last_modified, sha256 FROM files "
+                    f"WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                for key, path, size, etag, last_modified, sha256 in cur:
+                    rows[key] = {"path": path, "size": size, "etag": etag,
+                                 "last_modified": last_modified, "sha256": sha256}
+        return rows
+
+    def completed(self, adapter, files, output_dir, sizes=None):
+        # Keys of files the manifest has as complete in output_dir and that are still on
+        # disk. The same host file in another album is not done here. sizes, if given,
+        # is filled with the size of every file it has seen before, wherever it went.
+        done = set()
+        paths = {adapter.file_key(f): os.path.normpath(os.path.join(output_dir, f["name"])) for f in files}
+        for key, row in self.lookup(paths).items():
+            if sizes is not None:
+                sizes[key] = row["size"]
+            if os.path.normpath(row["path"]) != paths[key]:
+                continue
+            try:
+                if os.path.getsize(row["path"]) == row["size"]:
+                    done.add(key)
+            except OSError:
+                pass
+        return done
+
+manifest = Manifest()
+
+# =============================
+# CONTENT STORE
+# =============================
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents (btrfs, XFS, ...)
+
+def link_file(src, dst, mode=None):
+    # Puts src's content at dst without copying bytes where the filesystem allows it:
+    # a hardlink (same inode), a reflink (copy-on-write clone), else a plain copy.
+    # dst is replaced atomically. Returns the method that worked.
+    mode = mode or STORE_LINK
+    temp = f"{dst}.{os.getpid()}-{threading.get_ident()}.link"
+    if mode == "hardlink":
+        try:
+            os.link(src, temp)
+            os.replace(temp, dst)
+            return "hardlink"
+        except OSError:
+            pass  # Other filesystem, or no hardlinks there
+    if mode in ("hardlink", "reflink"):
+        try:
+            import fcntl
+            with open(src, "rb") as s, open(temp, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            os.replace(temp, dst)
+            return "reflink"
+        except (ImportError, OSError):
+            if os.path.exists(temp):
+                os.remove(temp)
+    shutil.copyfile(src, temp)
+    os.replace(temp, dst)
+    return "copy"
+
+class ContentStore:
+    # With --store every finished file is kept once under STORE_DIR, named by its
+    # SHA-256, and an SQLite index maps host file keys to those blobs. A file that
+    # another album or mirror already brought in reaches the new album as a link
+    # instead of a transfer. Both tables are primary-key lookups, so the index stays
+    # fast with millions of entries.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.conn = None
+        self.db_path = None
+
+    def root(self):
+        return STORE_DIR or os.path.join(BASE_DIR, ".store")
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root(), sha256[:2], sha256[2:4], sha256)
+
+    def _db(self):
+        path = os.path.join(self.root(), "index.sqlite")
+        if self.conn is None or self.db_path != path:
+            os.makedirs(self.root(), exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL}")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER, added_at REAL) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, sha256 TEXT) WITHOUT ROWID")
+            self.db_path = path
+        return self.conn
+
+    def find(self, key=None, sha256=None):
+        # (sha256, size) of the stored copy of a file, by host hash or else by file key
+        with self.lock:
+            db = self._db()
+            if not sha256 and key:
+                row = db.execute("SELECT sha256 FROM keys WHERE key = ?", (key,)).fetchone()
+                sha256 = row[0] if row else None
+            if not sha256:
+                return None
+            sha256 = sha256.lower()
+            row = db.execute("SELECT size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return None
+        try:
+            if os.path.getsize(self.blob_path(sha256)) == row[0]:
+                return sha256, row[0]
+        except OSError:
+            pass
+        with self.lock:
+            db = self._db()
+            db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))  # Blob removed by hand
+            db.commit()
+        return None
+
+    def checkout(self, key, sha256, path):
+        # Places the stored copy of a file at path. Returns "linked", "skipped" when path
+        # already is that copy, or None when the store does not have the file.
+        try:
+            found = self.find(None if REVALIDATE else key, sha256)
+            if found is None:
+                return None
+            sha256, size = found
+            blob = self.blob_path(sha256)
+            if os.path.exists(path) and os.path.samefile(blob, path):
+                result = "skipped"
+            else:
+                with tracer.span("store link", "file", file=os.path.basename(path)):
+                    link_file(blob, path)
+                metrics.inc("store_linked_bytes_total", size)
+                result = "linked"
+            if key:
+                self._remember(key, sha256)
+        except (OSError, sqlite3.Error) as e:
+            print(f"\n⚠ Content store lookup failed for {os.path.basename(path)}: {e}")
+            return None
+        if key:
+            manifest.record(key, path, size, sha256=sha256)
+        return result
+
+    def add(self, key, path, sha256=None):
+        # Takes a finished download into the store and returns its SHA-256, hashing the
+        # file first when the transfer did not. A file the store already holds is
+        # swapped for a link to the stored copy, so the disk holds it once.
+        try:
+            if not sha256:
+                with tracer.span("store hash", "file", file=os.path.basename(path)):
+                    h = hashlib.sha256()
+                    with open(path, "rb") as f:
+                        for block in iter(lambda: f.read(1024 * 1024), b""):
+                            h.update(block)
+                    sha256 = h.hexdigest()
+            sha256 = sha256.lower()
+            size = os.path.getsize(path)
+            blob = self.blob_path(sha256)
+            if self.find(sha256=sha256) is not None:
+                if not os.path.samefile(blob, path):
+                    link_file(blob, path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                link_file(path, blob)
+            with self.lock:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (sha256, size, time.time()))
+                db.commit()
+            if key:
+                self._remember(key, sha256)
+        except (OSError, sqlite3.Error) as e:
+            print(f"\n⚠ Could not add {os.path.basename(path)} to the content store: {e}")
+        return sha256
+
+    def _remember(self, key, sha256):
+        with self.lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO keys VALUES (?, ?)", (key, sha256))
+            db.commit()
+
+store = ContentStore()
+
 # =============================
 # SITE ADAPTERS
 # =============================
 
 class SiteAdapter:
+    mirrors = None  # MirrorSet of adapters whose files are served by interchangeable domains
+    streams_listing = False  # iter_files yields entries while the listing is still downloading
+
     def __init__(self, url, proxies=None):
         self.url = url
         self.proxies = proxies
+        self._listings = {}
+
+    def get_album_name(self):
+        raise NotImplementedError
+
+    def get_files(self):
+        raise NotImplementedError
+
+    def iter_files(self):
+        # Adapters that can list incrementally override this to yield entries as they
+        # arrive; queue_worker starts downloading from the first one
+        yield from self.get_files()
+
+    def resolve(self, file, output_dir):
+        # Plain HTTP adapters describe a transfer instead of running it, so either
+        # engine can carry it out. None means the adapter does its own download_file.
+        return None
+
+    def download_file(self, file, output_dir):
+        target = self.resolve(file, output_dir)
+        if target is None:
+            raise NotImplementedError
+        if store.enabled:
+            placed = store.checkout(target["key"], target["sha256"], target["path"])
+            if placed:
+                return placed
+        if target["probe"]:
+            # Check existing file size with HEAD request
+            skip, target["size"] = self._probe(file, target["url"], target["path"])
+            if skip:
+                return "skipped"
+        elif local_copy_matches(target):
+            manifest.record(target["key"], target["path"], target["size"])
+            return "skipped"
+        return self._download(target["url"], target["path"], target["name"], target["size"],
+                              target["headers"], key=target["key"], sha256=target["sha256"])
+
+    def _target(self, file, output_dir, url=None, headers=None, probe=True):
+        return {
+            "url": url or file["url"],
+            "path": os.path.join(output_dir, file["name"]),
+            "name": file["name"],
+            "size": file.get("size", 0),
+            "headers": headers or HEADERS,
+            "key": self.file_key(file),
+            "sha256": file.get("hash_sha256"),  # Pixeldrain lists carry one
+            "probe": probe,
+        }
+
+    def _iter_links(self, key, url, pattern):
+        # Yields file entries for every link on an album page while the page is still
+        # downloading; the full list goes to the listing cache at the end
+        cached = self._listings.get(key) or listing_cache.get(key)
+        if cached is not None:
+            self._listings[key] = cached
+            yield from cached
+            return
+        files = []
+        with self._get(url, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                for l in re.findall(pattern, line.decode(r.encoding or "utf-8", "replace")):
+                    entry = {"id": l.split("/")[-1], "name": l.split("/")[-1], "size": 0, "url": l}
+                    files.append(entry)
+                    yield entry
+        self._listings[key] = files
+        listing_cache.put(key, files)
+
+    def _cached_listing(self, key, fetch):
+        # get_album_name and get_files share one fetch per adapter; the disk cache
+        # lets a later run skip it entirely while the entry is fresh
+        if key not in self._listings:
+            data = listing_cache.get(key)
+            if data is None:
+                data = fetch()
+                listing_cache.put(key, data)
+            self._listings[key] = data
+        return self._listings[key]
+
+    def file_key(self, file):
+        # Stable identity of a file across runs, used by the manifest
+        return file.get("url") or f"{type(self).__name__}:{file['id']}"
+
+    # -------------------------
+    # Shared transfer helpers
+    # -------------------------
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault("headers", HEADERS)
+        if not proxy_pool.proxies or "proxies" in kwargs:
+            kwargs.setdefault("proxies", self.proxies)
+            return self._send(method, url, None, **kwargs)
+        tried = []
+        while True:
+            proxy = proxy_pool.pick(urlparse(url).netloc, tried)
+            tried.append(proxy)
+            kwargs["proxies"] = {"http": proxy.url, "https": proxy.url}
+            try:
+                r = self._send(method, url, proxy, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not proxy_pool.failover(tried):
+                    raise
+                continue
+            # 407 and 502 come from the proxy itself
+            if r.status_code not in (407, 502) or not proxy_pool.failover(tried):
+                return r
+            r.close()
+
+    def _send(self, method, url, proxy, **kwargs):
+        host = urlparse(url).netloc
+        ctl = rate_control.get(proxy_pool.route(proxy, host))
+        ctl.before_request()
+        metrics.inc("requests_total", host=host)
+        started = time.monotonic()
+        try:
+            # With stream=True this covers connecting and waiting for the headers only
+            with tracer.span(f"{method} (connect + TTFB)", "http", host=host) as span:
+                r = sessions.get(host).request(method, url, **kwargs)
+                span.set(status=r.status_code)
+        except Exception:
+            metrics.inc("request_errors_total", host=host)
+            proxy_pool.release(proxy, ok=False)
+            raise
+        metrics.observe("ttfb_seconds", time.monotonic() - started, host=host)
+        r.proxy = proxy
+        proxy_pool.release(proxy, ok=r.status_code not in (407, 502), throttled=r.status_code == 429)
+        if r.status_code == 429:
+            metrics.inc("throttled_total", host=host)
+            wait = ctl.on_throttle(parse_retry_after(r.headers.get("Retry-After")))
+            print(f"\n⚠ Rate limit (429) from {host}, holding it for {wait:.1f}s: {ctl.snapshot()}")
+        elif r.ok:
+            ctl.on_success()
+        return r
+
+    def _get(self, url, **kwargs):
+        return self._request("GET", url, **kwargs)
+
+    def _head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self._request("HEAD", url, **kwargs)
+
+    def _via_mirror(self, url, attempt_fn):
+        # One attempt at url on its fastest healthy mirror. A mirror that fails is rested
+        # and MirrorSwitch sends the next attempt, resuming from the .part, to another.
+        if self.mirrors is None:
+            return attempt_fn(url)
+        url = self.mirrors.pick(url, self._get)
+        try:
+            return attempt_fn(url)
+        except Exception as e:
+            self.mirrors.fail_over(url, e)
+            raise
+
+    def _retrying(self, name, attempt_fn, host=None):
+        # Runs attempt_fn until it succeeds; returns its result, or None once MAX_RETRIES is spent
+        attempt = 0
+        while attempt < MAX_RETRIES:
+            try:
+                return attempt_fn()
+            except RangeNotSupported:
+                raise
+            except MirrorSwitch as e:
+                print(f"\n⚠ {name}: {e}")
+                continue
+            except requests.exceptions.HTTPError as e:
+                metrics.inc("retries_total", host=host)
+                if e.response.status_code == 429:
+                    # The host's controller holds the next request until the block expires
+                    continue
+                else:
+                    attempt += 1
+                    wait = 2 ** attempt + random.uniform(0.5, 1.5)
+                    print(f"\n⚠ HTTP error on {name}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
+                    with tracer.span("retry backoff", "wait", attempt=attempt):
+                        time.sleep(wait)
+            except Exception as e:
+                metrics.inc("retries_total", host=host)
+                attempt += 1
+                wait = 2 ** attempt + random.uniform(0.5, 1.5)
+                print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
+                with tracer.span("retry backoff", "wait", attempt=attempt):
+                    time.sleep(wait)
+
+        metrics.inc("gave_up_total", host=host)
+        print(f"\n❌ Gave up on {name}")
+        return None
+
+    def _probe(self, file, url, path):
+        # HEAD the file and decide whether the copy on disk is current.
+        # Returns (skip, size); size is 0 when the host did not say.
+        with tracer.span("probe", "file", file=file.get("name")):
+            try:
+                head = self._head(url)
+            except Exception:
+                return False, 0
+            return self._judge_copy(file, path, head.headers)
+
+    def _judge_copy(self, file, path, head_headers):
+        size = int(head_headers.get("Content-Length", 0) or 0)
+        if not (os.path.exists(path) and os.path.getsize(path) == size):
+            return False, size
+        key = self.file_key(file)
+        etag, last_modified = head_headers.get("ETag"), head_headers.get("Last-Modified")
+        row = manifest.get(key)
+        if row and ((etag and row["etag"] and etag != row["etag"]) or
+                    (last_modified and row["last_modified"] and last_modified != row["last_modified"])):
+            return False, size
+        manifest.record(key, path, size, etag, last_modified)
+        return True, size
+
+    def _download(self, url, path, name, size=0, headers=None, key=None, sha256=None):
+        headers = headers or HEADERS
+        temp_path = path + ".part"
+        state_path = temp_path + ".segs"
+
+        for check in range(2):
+            digest = StreamHash()
+            # Large files with a known size go over several ranged connections. A plain
+            # .part left by a single-stream run keeps resuming as a single stream.
+            segmented = size > 0 and (os.path.exists(state_path) or (
+                SEGMENTS > 1 and size >= segment_threshold() and not os.path.exists(temp_path)
+            ))
+            if segmented:
+                try:
+                    ok = self._download_segmented(url, temp_path, name, size, headers, digest)
+                except RangeNotSupported:
+                    print(f"\n⚠ {name}: host ignores Range, falling back to a single stream")
+                    for p in (temp_path, state_path):
+                        if os.path.exists(p):
+                            os.remove(p)
+                    segmented = False
+                    ok = self._retrying(name, lambda: self._via_mirror(
+                        url, lambda u: self._stream(u, temp_path, name, size, headers, digest)), urlparse(url).netloc)
+            else:
+                ok = self._retrying(name, lambda: self._via_mirror(
+                    url, lambda u: self._stream(u, temp_path, name, size, headers, digest)), urlparse(url).netloc)
+
+            if not ok:
+                return "failed"
+
+            expected = expected_digest(key, sha256, ok)
+            if segmented and digest.offset < size:
+                # Segments that finished ahead of the hashed front are only worth a
+                # read pass when there is a hash to check
+                if expected:
+                    with tracer.span("hash read-back", "file", file=name):
+                        digest.resume(temp_path, size)
+                else:
+                    digest = StreamHash("")
+            actual = digest.hexdigest()
+            if not expected or not actual or actual == expected.lower():
+                break
+            print(f"\n❌ Checksum mismatch on {name}, fetching it again")
+            os.remove(temp_path)
+        else:
+            return "failed"
+
+        os.replace(temp_path, path)
+        actual = actual if digest.algo == "sha256" else None
+        if store.enabled:
+            actual = store.add(key, path, actual)
+        if key:
+            manifest.record(key, path, os.path.getsize(path), ok.get("etag"), ok.get("last_modified"), actual)
+        return "downloaded"
+
+    def _stream(self, url, temp_path, name, size, base_headers, digest):
+        host = urlparse(url).netloc
+        headers = base_headers.copy()
+        downloaded = 0
+
+        if os.path.exists(temp_path):
+            downloaded = os.path.getsize(temp_path)
+            headers["Range"] = f"bytes={downloaded}-"
+
+        with self._get(url, headers=headers, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            if downloaded and r.status_code != 206:
+                downloaded = 0  # Range ignored, the body is the whole file
+            digest.resume(temp_path, downloaded)
+            expected = int(r.headers.get("Content-Length", 0))
+            total_size = size if size > 0 else expected + downloaded
+            mode = "ab" if downloaded else "wb"
+            received = 0
+            watch = self.mirrors.watch(url) if self.mirrors else None
+
+            bar = progress.start_file(name, total_size, downloaded)
+            try:
+                with tracer.span("transfer", "file", file=name, offset=downloaded) as span, \
+                        WriteBehindFile(temp_path, mode) as f:
+                    if total_size > 0:
+                        f.preallocate(total_size, keep_size=True)
+                    for chunk in iter_body(r):
+                        # PAUSE HANDLING
+                        wait_if_paused()
+
+                        f.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+                        bar.update(len(chunk))
+                        waited = limiter.throttle(host, len(chunk))
+                        if watch is not None:
+                            watch.update(len(chunk), waited)
+                    span.set(bytes=received)
+            finally:
+                bar.close()
+                metrics.inc("bytes_total", received, host=host)
+            if expected and received < expected:
+                raise IOError(f"connection closed after {received} of {expected} bytes")
+            if watch is not None:
+                watch.done()
+        return validators(r)
+
+    def _download_segmented(self, url, temp_path, name, size, headers, digest):
+        # Each segment is [start, end, done]; the list is saved next to the .part so an
+        # interrupted segment restarts at its own offset instead of the whole file.
+        # digest follows the lowest unfinished segment as it streams; when that one is
+        # done, the next unfinished segment reads back what it and any finished
+        # segments before it already wrote, then carries on inline.
+        state_path = temp_path + ".segs"
+        segments = None
+        if os.path.exists(state_path) and os.path.exists(temp_path):
+            try:
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+                if state.get("size") == size:
+                    segments = state["segments"]
+            except (OSError, ValueError, KeyError):
+                segments = None
+        if segments is None:
+            step = -(-size // SEGMENTS)
+            segments = [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+            with open(temp_path, "wb") as f:
+                preallocate(f, size)  # Every segment can now seek to its offset
+
+        host = urlparse(url).netloc
+        lock = threading.Lock()
+        save_lock = threading.Lock()
+        seen = {}
+        settled = [seg[0] + seg[2] > seg[1] for seg in segments]  # finished and closed
+        front = segments[settled.index(False)] if False in settled else None  # the segment that hashes
+
+        def settle(seg):
+            nonlocal front
+            with lock:
+                settled[segments.index(seg)] = True
+                if front is seg:
+                    front = segments[settled.index(False)] if False in settled else None
+
+        def save_state():
+            with save_lock:
+                with lock:
+                    data = json.dumps({"size": size, "segments": segments})
+                with open(state_path + ".tmp", "w") as f:
+                    f.write(data)
+                os.replace(state_path + ".tmp", state_path)
+
+        save_state()
+
+        bar = progress.start_file(name, size, sum(seg[2] for seg in segments))
+        try:
+            def fetch_segment(seg, url):
+                start = seg[0] + seg[2]
+                if start > seg[1]:
+                    return True
+                seg_headers = headers.copy()
+                seg_headers["Range"] = f"bytes={start}-{seg[1]}"
+                with self._get(url, headers=seg_headers, stream=True, timeout=60) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise RangeNotSupported(name)
+                    seen.update(validators(r))
+                    seg_bar = bar.fork()
+                    received = 0
+                    watch = self.mirrors.watch(url) if self.mirrors else None
+                    f = None
+                    flushed = seg[2]  # progress the writer has confirmed is in the file
+                    try:
+                        with tracer.span("segment transfer", "file", file=name, start=start, end=seg[1]), \
+                                WriteBehindFile(temp_path, "r+b") as f:
+                            f.seek(start)
+                            unsaved = 0
+                            for chunk in iter_body(r):
+                                # PAUSE HANDLING
+                                wait_if_paused()
+
+                                chunk = chunk[:seg[1] + 1 - seg[0] - seg[2]]
+                                f.write(chunk)
+                                with lock:
+                                    at = seg[0] + seg[2]
+                                    seg[2] += len(chunk)
+                                    hashing = front is seg and digest.h is not None
+                                if hashing:
+                                    if digest.offset != at:
+                                        # Catch up on what is already in the file before this chunk
+                                        f.flush()
+                                        with tracer.span("hash catch-up", "file", file=name, bytes=at - digest.offset):
+                                            digest.resume(temp_path, at)
+                                    digest.update(chunk)
+                                seg_bar.update(len(chunk))
+                                received += len(chunk)
+                                waited = limiter.throttle(host, len(chunk))
+                                if watch is not None:
+                                    watch.update(len(chunk), waited)
+                                unsaved += len(chunk)
+                                if unsaved >= 4 * 1024 * 1024:
+                                    # Only record progress that has reached the file
+                                    f.flush()
+                                    flushed = seg[2]
+                                    save_state()
+                                    unsaved = 0
+                                if seg[0] + seg[2] > seg[1]:
+                                    break
+                    except BaseException:
+                        if f is not None and f.error is not None:
+                            # Writes after the last checkpoint may be missing, so the
+                            # retry starts over from it
+                            with lock:
+                                seg[2] = flushed
+                        raise
+                    finally:
+                        seg_bar.close()
+                        metrics.inc("bytes_total", received, host=host)
+                    finished = seg[0] + seg[2] > seg[1]
+                    if finished:
+                        settle(seg)
+                        if watch is not None:
+                            watch.done()
+                save_state()
+                if not finished:
+                    raise IOError(f"segment {seg[0]}-{seg[1]} ended early")
+                return True
+
+            pending = [seg for seg in segments if seg[0] + seg[2] <= seg[1]]
+            with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="segment") as ex:
+                results = list(ex.map(
+                    lambda seg: self._retrying(f"{name} [{seg[0]}-{seg[1]}]",
+                                               lambda: self._via_mirror(url, lambda u: fetch_segment(seg, u)), host),
+                    pending
+                ))
+        finally:
+            bar.close()
+
+        if not all(results):
+            return None
+        os.remove(state_path)
+        return seen or validators(None)
+
+# -----------------------------
+# Pixeldrain Adapter
+# -----------------------------
+class PixeldrainAdapter(SiteAdapter):
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        parsed = urlparse(url)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) >= 2 and parts[0] == "l":
+            self.album_id = parts[1]
+        else:
+            raise ValueError("Invalid Pixeldrain URL")
+        self.api = f"{parsed.scheme or 'https'}://{parsed.netloc}/api"
+
+    def _album_info(self):
+        def fetch():
+            r = self._get(f"{self.api}/list/{self.album_id}")
+            r.raise_for_status()
+            return r.json()
+        return self._cached_listing(f"pixeldrain:{self.album_id}", fetch)
+
+    def get_album_name(self):
+        j = self._album_info()
+        return safe_name(j.get("name") or j.get("title") or f"Pixeldrain_{self.album_id}")
+
+    def get_files(self):
+        return self._album_info().get("files", [])
+
+    def file_key(self, file):
+        return f"pixeldrain:{file['id']}"
+
+    def resolve(self, file, output_dir):
+        headers = HEADERS.copy()
+        headers["User-Agent"] = f"PixeldrainDownloader/2.1-{random.randint(1000,9999)}"
+        url = f"{self.api}/file/{file['id']}"
+        # The listing already carries the size, so no HEAD is needed
+        return self._target(file, output_dir, url=url, headers=headers, probe=False)
+
+# -----------------------------
+# Bunkr Adapter
+# -----------------------------
+class BunkrAdapter(SiteAdapter):
+    LINK_PATTERN = r'https://files\.bunkr\.\w+/[^\s"\']+'
+    streams_listing = True
+
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        self.album_id = url.rstrip("/").split("/")[-1]
+        self.mirrors = bunkr_mirrors
+
+    def get_album_name(self):
+        return safe_name(f"Bunkr_{self.album_id}")
+
+    def get_files(self):
+        return list(self.iter_files())
+
+    def iter_files(self):
+        # The album page is the same on every mirror: the given one first, then the
+        # fastest others, as long as nothing has been listed yet
+        tried = []
+        for domain in [self.mirrors.domain_of(self.url)] + self.mirrors.ranked(self.url):
+            if domain in tried:
+                continue
+            tried.append(domain)
+            url = self.mirrors.on(self.url, domain)
+            listed = 0
+            try:
+                for entry in self._iter_links(f"bunkr:{self.url}", url, self.LINK_PATTERN):
+                    listed += 1
+                    self.mirrors.learn(entry["url"])
+                    yield entry
+                return
+            except Exception as e:
+                if listed or len(tried) == len(self.mirrors.domains):
+                    raise
+                if self.mirrors.at_fault(e):
+                    self.mirrors.failed(url)
+                print(f"\n⚠ Album page on {domain} failed ({e}), trying another mirror")
+
+    def resolve(self, file, output_dir):
+        # Transfers pick their mirror per attempt (_via_mirror, AsyncEngine._stream).
+        # Picking may probe, which would block the asyncio engine's loop here.
+        return self._target(file, output_dir, url=self.mirrors.best(file["url"]))
+
+# -----------------------------
+# K00 Adapter
+# -----------------------------
+class K00Adapter(SiteAdapter):
+    LINK_PATTERN = r'https://k00\.fr/[^\s"\']+'
+    streams_listing = True
+
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        self.album_id = url.rstrip("/").split("/")[-1]
+
+    def get_album_name(self):
+        return safe_name(f"K00_{self.album_id}")
+
+    def get_files(self):
+        return list(self.iter_files())
+
+    def iter_files(self):
+        return self._iter_links(f"k00:{self.url}", self.url, self.LINK_PATTERN)
+
+    def resolve(self, file, output_dir):
+        return self._target(file, output_dir)
+
+# -----------------------------
+# SingleFile Adapter
+# -----------------------------
+class SingleFileAdapter(SiteAdapter):
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        self.name = urlparse(url).path.split("/")[-1] or "file"
+        if bunkr_mirrors.domain_of(url):
+            self.mirrors = bunkr_mirrors  # files.bunkr.* links
+
+    def get_album_name(self):
+        return safe_name(f"Single_{self.name}")
+
+    def get_files(self):
+        return [{"id": self.name, "name": self.name, "size": 0, "url": self.url}]
+
+    def resolve(self, file, output_dir):
+        return self._target(file, output_dir)
+
+# -----------------------------
+# AnonFiles Adapter
+# -----------------------------
+class AnonFilesAdapter(SiteAdapter):
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        parsed = urlparse(url)
+        self.file_id = parsed.path.strip("/").split("/")[-1]
+
+    def get_album_name(self):
+        return safe_name(f"AnonFiles_{self.file_id}")
+
+    def get_files(self):
+        def fetch():
+            r = self._get(f"https://api.anonfiles.com/v2/file/{self.file_id}/info")
+            r.raise_for_status()
+            j = r.json()
+            if not j.get("status"):
+                raise ValueError("Invalid AnonFiles URL")
+            return j["data"]["file"]
+        file_info = self._cached_listing(f"anonfiles:{self.file_id}", fetch)
+        return [{"id": self.file_id, "name": file_info["metadata"]["name"], "size": file_info["metadata"]["size"]["bytes"], "url": file_info["url"]["full"]}]
+
+    def resolve(self, file, output_dir):
+        # Same direct-link handling as SingleFileAdapter
+        return self._target(file, output_dir)
+
+# -----------------------------
+# Mega Adapter
+# -----------------------------
+# Public links need no account: the API answers for a file or shared folder handle
+# and the key in the link decrypts everything. Keys and MACs are lists of 32-bit
+# big-endian words, as in Mega's own clients.
+class MegaError(Exception):
+    def __init__(self, code):
+        super().__init__(f"Mega API error {code}")
+        self.code = code
+
+def mega_b64decode(data):
+    data = data.replace("-", "+").replace("_", "/").replace(",", "")
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def words(data):
+    return list(struct.unpack(f">{len(data) // 4}I", data))
+
+def words_bytes(a):
+    return struct.pack(f">{len(a)}I", *a)
+
+def mega_decrypt_key(data, key):
+    # Node keys are AES-ECB encrypted with the share's key
+    from Crypto.Cipher import AES
+    return words(AES.new(words_bytes(key), AES.MODE_ECB).decrypt(mega_b64decode(data)))
+
+def mega_file_key(key):
+    # 8-word file key -> (AES key, CTR nonce, expected meta-MAC)
+    return ([key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7]],
+            key[4:6], key[6:8])
+
+def mega_decrypt_attr(data, key):
+    from Crypto.Cipher import AES
+    raw = AES.new(words_bytes(key), AES.MODE_CBC, b"\0" * 16).decrypt(mega_b64decode(data))
+    raw = raw.rstrip(b"\0").decode("utf-8", "replace")
+    if not raw.startswith('MEGA{"'):
+        raise ValueError("Mega attributes did not decrypt; wrong key in the link?")
+    return json.loads(raw[4:])
+
+def mega_chunks(size):
+    # Mega MACs files over chunks of 128 KB, 256 KB, ... growing to 1 MB
+    start, step = 0, 0x20000
+    while start + step < size:
+        yield start, step
+        start += step
+        if step < 0x100000:
+            step += 0x20000
+    yield start, size - start
+
+def mega_pieces(size, piece_size=MEGA_PIECE_SIZE):
+    # Groups consecutive chunks into download ranges of about piece_size
+    piece = []
+    for chunk in mega_chunks(size):
+        piece.append(chunk)
+        if chunk[0] + chunk[1] - piece[0][0] >= piece_size:
+            yield piece
+            piece = []
+    if piece:
+        yield piece
+
+class MegaAdapter(SiteAdapter):
+    # file/<id>#<key> and folder/<id>#<key>[/folder|file/<sub>] links, plus the old
+    # #!id!key and #F!id!key forms. Folders are listed into their files (with
+    # subdirectories), files download as SEGMENTS parallel ranges that are decrypted
+    # and MAC-checked per chunk, and a .part.mega sidecar lets a restart resume.
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        parsed = urlparse(url)
+        fragment = parsed.fragment
+        self.sub = None
+        m = re.match(r"/(file|folder)/([\w-]+)", parsed.path)
+        if m:
+            self.kind, self.handle = m.groups()
+            self.key = fragment.split("/")[0]
+            sub = re.search(r"/(?:file|folder)/([\w-]+)$", fragment)
+            self.sub = sub.group(1) if sub else None
+        elif fragment.startswith("!") or fragment.startswith("F!"):
+            parts = fragment.split("!")
+            self.kind = "folder" if parts[0] == "F" else "file"
+            self.handle, self.key = parts[1], parts[2] if len(parts) > 2 else ""
+            self.sub = parts[3] if len(parts) > 3 else None
+        else:
+            raise ValueError("Invalid Mega URL")
+        if not self.key:
+            raise ValueError("Mega URL has no key")
+
+    def _api(self, command, folder=None):
+        params = {"id": random.randint(0, 0xFFFFFFFF)}
+        if folder:
+            params["n"] = folder
+        for attempt in range(MAX_RETRIES):
+            r = self._request("POST", MEGA_API, params=params, data=json.dumps([command]), timeout=60)
+            r.raise_for_status()
+            reply = r.json()
+            code = reply if isinstance(reply, int) else reply[0] if isinstance(reply[0], int) else None
+            if code is None:
+                return reply[0]
+            if code != -3:  # -3 = EAGAIN, the API asks to try again
+                raise MegaError(code)
+            time.sleep(2 ** attempt + random.uniform(0, 1))
+        raise MegaError(-3)
+
+    def _listing(self):
+        def fetch():
+            if self.kind == "file":
+                key = words(mega_b64decode(self.key))
+                info = self._api({"a": "g", "p": self.handle})
+                name = mega_decrypt_attr(info["at"], mega_file_key(key)[0])["n"]
+                return {"name": name, "files": [
+                    {"id": self.handle, "name": safe_name(name), "size": info["s"], "key": key, "folder": None}
+                ]}
+            return self._folder_listing()
+        listing = self._cached_listing(f"mega:{self.kind}:{self.handle}", fetch)
+        if self.sub is None or self.kind == "file":
+            return listing
+        # A link into a subfolder (or one file) of the share
+        prefix = listing["paths"].get(self.sub)
+        if prefix is not None:
+            files = [dict(f, name=f["name"][len(prefix) + 1:])
+                     for f in listing["files"] if f["name"].startswith(prefix + "/")]
+            return {"name": prefix.rsplit("/", 1)[-1], "files": files}
+        files = [f for f in listing["files"] if f["id"] == self.sub]
+        return {"name": files[0]["name"] if files else listing["name"], "files": files}
+
+    def _folder_listing(self):
+        share_key = words(mega_b64decode(self.key))
+        nodes = self._api({"a": "f", "c": 1, "r": 1, "ca": 1}, folder=self.handle)["f"]
+        names, parents, keys = {}, {}, {}
+        for node in nodes:
+            try:
+                # "k" is "<handle>:<key>", the key encrypted with the share key
+                key = mega_decrypt_key(node["k"].split("/")[0].split(":", 1)[1], share_key)
+                attr_key = mega_file_key(key)[0] if node["t"] == 0 else key
+                names[node["h"]] = safe_name(mega_decrypt_attr(node["a"], attr_key)["n"])
+            except (KeyError, IndexError, ValueError):
+                continue
+            parents[node["h"]] = node.get("p")
+            keys[node["h"]] = key
+        root = self.handle if self.handle in names else next(h for h, p in parents.items() if p not in names)
+
+        def path_of(handle):
+            parts = []
+            while handle in names and handle != root:
+                # A share can name a node "." or ".."; joined into a path those would climb
+                # out of the album folder
+                name = names[handle]
+                parts.append(name if name.strip(".") else name.replace(".", "_"))
+                handle = parents[handle]
+            return "/".join(reversed(parts)) if handle == root else None
+
+        files, paths = [], {}
+        for node in nodes:
+            path = path_of(node["h"]) if node["h"] in names else None
+            if path is None:
+                continue
+            if node["t"] == 1:
+                paths[node["h"]] = path
+            elif node["t"] == 0:
+                files.append({"id": node["h"], "name": path, "size": node.get("s", 0),
+                              "key": keys[node["h"]], "folder": self.handle})
+        return {"name": names.get(root, self.handle), "files": files, "paths": paths}
+
+    def get_album_name(self):
+        return safe_name(f"Mega_{self._listing()['name']}")
+
+    def get_files(self):
+        return self._listing()["files"]
+
+    def file_key(self, file):
+        return f"mega:{file['id']}"
+
+    def download_file(self, file, output_dir):
+        name = file["name"]
+        path = os.path.join(output_dir, *name.split("/"))
+        key = self.file_key(file)
+        size = file["size"]
+        root = os.path.realpath(output_dir)
+        if os.path.commonpath([root, os.path.realpath(path)]) != root:
+            print(f"\n❌ Unsafe path in Mega share: {name}")
+            return "failed"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if store.enabled:
+            placed = store.checkout(key, None, path)
+            if placed:
+                return placed
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            manifest.record(key, path, size)
+            return "skipped"
+        for check in range(2):
+            try:
+                ok = self._download_mega(file, path)
+            except MegaError as e:
+                print(f"\n❌ Error downloading {name} from Mega: {e}")
+                return "failed"
+            if ok is None:
+                return "failed"
+            if ok:
+                break
+            print(f"\n❌ MAC mismatch on {name}, fetching it again")
+        else:
+            return "failed"
+        manifest.record(key, path, size, sha256=store.add(key, path) if store.enabled else None)
+        return "downloaded"
+
+    def _download_mega(self, file, path):
+        # Returns True when the file is in place, False on a MAC mismatch, None on failure
+        from Crypto.Cipher import AES
+
+        name, size = file["name"], file["size"]
+        aes_key, nonce, meta_mac = mega_file_key(file["key"])
+        key_bytes = words_bytes(aes_key)
+        mac_iv = words_bytes(nonce + nonce)
+        if file["folder"]:
+            info = self._api({"a": "g", "g": 1, "n": file["id"]}, folder=file["folder"])
+        else:
+            info = self._api({"a": "g", "g": 1, "p": file["id"]})
+        if "g" not in info:
+            raise MegaError("file not accessible")
+        if size == 0:
+            open(path, "wb").close()
+            return True
+        url = info["g"]
+        host = urlparse(url).netloc
+
+        temp_path = path + ".part"
+        state_path = temp_path + ".mega"
+        macs = {}
+        if os.path.exists(state_path) and os.path.exists(temp_path):
+            try:
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+                if state.get("size") == size:
+                    macs = {int(k): bytes.fromhex(v) for k, v in state["macs"].items()}
+            except (OSError, ValueError, KeyError):
+                macs = {}
+        if not macs:
+            with open(temp_path, "wb") as f:
+                preallocate(f, size)
+        lock = threading.Lock()
+
+        def save_state():
+            with lock:
+                data = json.dumps({"size": size, "macs": {k: v.hex() for k, v in macs.items()}})
+                with open(state_path + ".tmp", "w") as f:
+                    f.write(data)
+                os.replace(state_path + ".tmp", state_path)
+
+        pieces = list(mega_pieces(size))
+        bar = progress.start_file(name, size, sum(length for start, length in mega_chunks(size) if start in macs))
+
+        def fetch_piece(piece):
+            start, end = piece[0][0], piece[-1][0] + piece[-1][1] - 1
+            piece_bar = bar.fork()
+            try:
+                with self._get(f"{url}/{start}-{end}", stream=True, timeout=60) as r, \
+                        tracer.span("mega piece", "file", file=name, start=start, end=end):
+                    r.raise_for_status()
+                    data = bytearray()
+                    for chunk in iter_body(r):
+                        wait_if_paused()
+                        data += chunk
+                        piece_bar.update(len(chunk))
+                        limiter.throttle(host, len(chunk))
+                    metrics.inc("bytes_total", len(data), host=host)
+                if len(data) != end + 1 - start:
+                    raise IOError(f"range {start}-{end} returned {len(data)} bytes")
+                # AES calls release the GIL, so pieces decrypt in parallel
+                piece_macs = {}
+                with tracer.span("mega decrypt + MAC", "file", file=name, start=start), \
+                        WriteBehindFile(temp_path, "r+b") as f:
+                    for chunk_start, length in piece:
+                        offset = chunk_start - start
+                        plain = AES.new(key_bytes, AES.MODE_CTR, nonce=words_bytes(nonce),
+                                        initial_value=chunk_start // 16).decrypt(data[offset:offset + length])
+                        padded = plain + b"\0" * (-len(plain) % 16)
+                        piece_macs[chunk_start] = AES.new(key_bytes, AES.MODE_CBC, mac_iv).encrypt(padded)[-16:]
+                        f.seek(chunk_start)
+                        f.write(plain)
+                with lock:
+                    macs.update(piece_macs)
+                save_state()
+                return True
+            finally:
+                piece_bar.close()
+
+        pending = [piece for piece in pieces if piece[0][0] not in macs]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(SEGMENTS, len(pending))), thread_name_prefix="mega") as ex:
+                results = list(ex.map(
+                    lambda piece: self._retrying(f"{name} [{piece[0][0]}]", lambda: fetch_piece(piece), host),
+                    pending
+                ))
+        finally:
+            bar.close()
+        if not all(results):
+            return None
+
+        # The file MAC is a CBC-MAC over the chunk MACs, folded to two words
+        chunk_macs = b"".join(macs[start] for start, _ in mega_chunks(size))
+        file_mac = words(AES.new(key_bytes, AES.MODE_CBC, b"\0" * 16).encrypt(chunk_macs)[-16:])
+        os.remove(state_path)
+        if [file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]] != list(meta_mac):
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, path)
+        return True
+
+# =============================
+# ADAPTER FACTORY
+# =============================
+PIXELDRAIN_DOMAINS = ["pixeldrain.com"]
+
+K00_DOMAINS = ["k00.fr"]
+
+BUNKR_DOMAINS = [
+    "bunkr.me",
+    "bunkr.cr",
+    "bunkr.site",
+    "bunkr.si",
+    "bunkr.fi"
+]
+
+DIRECT_EXTENSIONS = ('.zip', '.mp4', '.jpg', '.png', '.pdf')  # Add more extensions as needed
+
+def host_matches(netloc, domain, subdomains=True):
+    return netloc == domain or (subdomains and netloc.endswith("." + domain))
+
+class AdapterRegistry:
+    # Maps hosts to adapter classes. An adapter is a class or a "module:Class" string
+    # that is imported the first time a URL needs it. Third-party adapters register
+    # as entry points in the "megadl.adapters" group, named after the host they
+    # serve, e.g. "gofile.io = megadl_gofile:GofileAdapter"; they are only looked up
+    # when no built-in route matches, and only the matching one is imported.
+    ENTRY_POINT_GROUP = "megadl.adapters"
+
+    def __init__(self):
+        self.routes = []
+        self.plugins = None
+        self.loaded = {}
+
+    def register(self, domains, adapter, path=None, subdomains=True):
+        # domains is kept by reference, so appending to e.g. BUNKR_DOMAINS later works.
+        # path restricts the route to URLs whose first path segment matches.
+        self.routes.append((domains, adapter, path, subdomains))
+
+    def _load(self, adapter):
+        if not isinstance(adapter, str):
+            return adapter
+        if adapter not in self.loaded:
+            module, _, attr = adapter.partition(":")
+            self.loaded[adapter] = getattr(importlib.import_module(module), attr)
+        return self.loaded[adapter]
+
+    def _entry_points(self):
+        if self.plugins is None:
+            from importlib import metadata
+            try:
+                found = metadata.entry_points(group=self.ENTRY_POINT_GROUP)
+            except TypeError:  # Python < 3.10
+                found = metadata.entry_points().get(self.ENTRY_POINT_GROUP, [])
+            self.plugins = [([ep.name], ep) for ep in found]
+        return self.plugins
+
+    def find(self, url):
+        parsed = urlparse(url)
+        netloc = parsed.netloc
+        first = parsed.path.strip("/").split("/")[0]
+        for domains, adapter, path, subdomains in self.routes:
+            if path is not None and path != first:
+                continue
+            if any(host_matches(netloc, d, subdomains) for d in domains):
+                return self._load(adapter)
+        for domains, ep in self._entry_points():
+            if any(host_matches(netloc, d) for d in domains):
+                if ep.value not in self.loaded:
+                    self.loaded[ep.value] = ep.load()
+                return self.loaded[ep.value]
+        # Fallback to single file if direct link (e.g., https://example.com/file.ext)
+        if parsed.path.endswith(DIRECT_EXTENSIONS):
+            return SingleFileAdapter
+        return None
+
+bunkr_mirrors = MirrorSet("bunkr", BUNKR_DOMAINS, discover=r"(?:^|\.)(bunkr\.[a-z]{2,})$")
+
+adapters = AdapterRegistry()
+adapters.register(PIXELDRAIN_DOMAINS, PixeldrainAdapter, path="l")
+adapters.register(PIXELDRAIN_DOMAINS, SingleFileAdapter, path="u")  # Single file on Pixeldrain
+adapters.register(BUNKR_DOMAINS, BunkrAdapter, subdomains=False)  # files.bunkr.* links are direct files
+adapters.register(K00_DOMAINS, K00Adapter)
+adapters.register(["anonfiles.com"], AnonFilesAdapter)
+adapters.register(["mega.nz", "mega.co.nz"], MegaAdapter)
+
+def get_adapter(url, proxies=None):
+    adapter = adapters.find(url)
+    if adapter is None:
+        raise ValueError("Site not supported yet")
+    return adapter(url, proxies=proxies)
+
+# =============================
+# EXTRACTION
+# =============================
+def extract_zip(path, dest):
+    # Runs in an extract worker process. Members are streamed to disk, never held in
+    # memory whole; entries escaping dest (zip-slip) and archives that would expand
+    # past ZIP_MAX_TOTAL / ZIP_MAX_RATIO, or lie about their sizes, are refused.
+    import zipfile
+
+    root = os.path.realpath(dest)
+    with zipfile.ZipFile(path, "r") as z:
+        infos = z.infolist()
+        total = sum(info.file_size for info in infos)
+        packed = max(1, os.path.getsize(path))
+        if total > ZIP_MAX_TOTAL or total / packed > ZIP_MAX_RATIO:
+            raise ValueError(f"refusing to expand {packed} bytes into {total} (zip bomb?)")
+        for info in infos:
+            target = os.path.realpath(os.path.join(root, info.filename))
+            if os.path.commonpath([root, target]) != root:
+                raise ValueError(f"unsafe path in archive: {info.filename}")
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with z.open(info) as src, open(target, "wb") as out:
+                written = 0
+                for block in iter(lambda: src.read(1024 * 1024), b""):
+                    written += len(block)
+                    if written > info.file_size:
+                        raise ValueError(f"{info.filename} is larger than its header says")
+                    out.write(block)
+    os.remove(path)  # Optional: remove zip after extract
+    return len(infos)
+
+class Extractor:
+    # Pipeline stage for --unzip: each zip is handed to a process pool as soon as it
+    # finishes, so extraction overlaps the rest of the downloads and uses several
+    # cores. Up to EXTRACT_QUEUE zips wait for a worker; beyond that submit() blocks.
+    def __init__(self, status_cb, workers=EXTRACT_WORKERS):
+        self.status_cb = status_cb
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(workers + EXTRACT_QUEUE)
+
+    def submit(self, path, dest, on_done):
+        self.slots.acquire()
+        with self.lock:
+            if self.pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.status_cb(f"Unzip: {os.path.basename(path)} queued")
+        queued = time.perf_counter()
+        future = self.pool.submit(extract_zip, path, dest)
+        future.add_done_callback(lambda f: self._finished(path, f, on_done, queued))
+
+    def _finished(self, path, future, on_done, queued):
+        self.slots.release()
+        tracer.complete("unzip (queued + extract)", "unzip", queued, track=path,
+                        args={"file": os.path.basename(path)})
+        try:
+            entries = future.result()
+            self.status_cb(f"Unzip: {os.path.basename(path)} extracted ({entries} entries)")
+        except Exception as e:
+            self.status_cb(f"Unzip: {os.path.basename(path)} failed: {e}")
+        on_done()
+
+# =============================
+# ALBUM QUEUE & WORKER
+# =============================
+album_queue = queue.Queue()
+
+metrics.gauge("queue_pending_files", lambda: sum(len(a.pending) for a in list(progress.albums)))
+metrics.gauge("in_flight_files", lambda: sum(a.in_flight for a in list(progress.albums)))
+metrics.gauge("queued_albums", album_queue.qsize)
+metrics.gauge("disk_queued_bytes", lambda: sum(w.queued for w in list(disk_writers.writers.values())))
+metrics.gauge("host_concurrency_limit",
+              lambda: {host: st["concurrency"] for host, st in rate_control.snapshot().items()})
+
+class PendingFiles:
+    # An album's waiting files in ORDER: as listed, or by size from the largest or the
+    # smallest, files of unknown size after the rest. Only files already listed and
+    # waiting (up to PENDING_PER_ALBUM) are ordered, so big albums are sorted in windows.
+    def __init__(self, size_of, order=None):
+        self.size_of = size_of
+        self.order = order or ORDER
+        self.heap = []
+        self.seq = 0
+        self.bytes = 0  # known size of everything waiting
+
+    def append(self, file):
+        size = self.size_of(file)
+        if self.order == "listing":
+            key = (0, self.seq)
+        elif not size:
+            key = (1, self.seq)
+        else:
+            key = (0, -size if self.order == "largest" else size, self.seq)
+        heapq.heappush(self.heap, (key, file))
+        self.seq += 1
+        self.bytes += size
+
+    def extend(self, files):
+        for file in files:
+            self.append(file)
+
+    def popleft(self):
+        file = heapq.heappop(self.heap)[1]
+        self.bytes -= self.size_of(file)
+        return file
+
+    def clear(self):
+        self.heap.clear()
+        self.bytes = 0
+
+    def __getitem__(self, i):
+        if i != 0:
+            raise IndexError(i)
+        return self.heap[0][1]
+
+    def __len__(self):
+        return len(self.heap)
+
+dispatch = threading.local()  # dispatch.straggler: the file this thread runs should be segmented
+
+class AlbumJob:
+    # Files arrive through the engine's feed() while the album is still being listed;
+    # at most PENDING_PER_ALBUM of them wait in memory, the lister blocks beyond that
+    def __init__(self, name, adapter, output_dir, on_done):
+        self.name = name
+        self.adapter = adapter
+        self.output_dir = output_dir
+        self.on_done = on_done
+        self.known_sizes = {}  # file key -> size from the manifest, for files the listing has no size for
+        self.pending = PendingFiles(self.size_of)
+        self.room = threading.Semaphore(PENDING_PER_ALBUM)
+        self.total = 0
+        self.in_flight = 0
+        self.listing_done = False
+        self.finished = False
+        self.queued = False
+        self.held = False  # Paused: no new files start, the ones in flight finish
+        self.cancelled = False
+        self.priority = 0
+        self.deadline = None  # epoch seconds; earlier deadlines go first among equal priorities
+        self.results = collections.Counter()
+        self.settled = 0  # files with a result, the sum of results
+        self.on_file = []
+        self.reserved = {}  # file key -> bytes of free space held for it
+        self.device = None
+        self.opened = time.perf_counter()  # start of the album's trace span
+        self.job = None  # daemon job id
+        self.downloads_done = False  # every file settled, extractions may still run
+        self.extracting = 0
+        self.released = False  # the album queue entry is done
+        self.wakeup = None  # AsyncEngine's asyncio.Event, created on the loop
+
+    def host_of(self, file):
+        return urlparse(file.get("url") or self.adapter.url).netloc
+
+    def size_of(self, file):
+        return file.get("size") or self.known_sizes.get(self.adapter.file_key(file), 0)
+
+    def rank(self):
+        return -self.priority, self.deadline or float("inf")
+
+    def straggler(self, file, workers):
+        # With ORDER largest, a file bigger than its share of what the album has left
+        # would run on alone long after the rest, so it is split into segments as well
+        size = self.size_of(file)
+        return ORDER == "largest" and size >= STRAGGLER_MIN_SIZE and size * workers > self.pending.bytes + size
+
+    def count(self, result, n=1):
+        # Progress reads settled from its own thread; iterating results there could
+        # race with a result seen for the first time
+        self.results[result] += n
+        self.settled += n
+
+    def record(self, file, result, seconds=None):
+        self.count(result)
+        host = self.host_of(file)
+        metrics.inc("files_total", host=host, result=result)
+        if seconds is not None:
+            metrics.observe("transfer_seconds", seconds, host=host)
+
+    def file_done(self, file, result):
+        # Called by the engines outside their locks, before on_done
+        for callback in self.on_file:
+            callback(self, file, result)
+
+    def idle(self):
+        # True exactly once, when listing has ended and the last file has settled
+        if self.finished or not self.listing_done or self.pending or self.in_flight:
+            return False
+        self.finished = True
+        return True
+
+def run_dispatched(straggler, fn, *args):
+    # Runs fn on this thread with the scheduler's hint for the file set
+    dispatch.straggler = straggler
+    try:
+        return fn(*args)
+    finally:
+        dispatch.straggler = False
+
+def segment_threshold():
+    return STRAGGLER_MIN_SIZE if getattr(dispatch, "straggler", False) else SEGMENT_MIN_SIZE
+
+class Scheduler:
+    # Long-lived worker pool fed with file jobs from every queued album. Albums are
+    # served round-robin so a small album is not stuck behind a huge one, and no
+    # host gets more than per_host files in flight at once.
+    def __init__(self, max_workers=MAX_WORKERS, per_host=PER_HOST_WORKERS):
+        self.per_host = per_host
+        self.workers = min(max_workers, per_host or max_workers)
+        self.cond = threading.Condition()
+        self.albums = collections.deque()
+        self.host_active = collections.Counter()
+        for i in range(max_workers):
+            threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True).start()
+
+    def open(self, album):
+        pass
+
+    def feed(self, album, files, skipped=0, failed=0):
+        for file in files:
+            album.room.acquire()
+            with self.cond:
+                if album.cancelled:
+                    album.room.release()
+                    album.count("cancelled")
+                    continue
+                album.pending.append(file)
+                if not album.queued:
+                    album.queued = True
+                    self.albums.append(album)
+                self.cond.notify()
+        with self.cond:
+            album.total += len(files) + skipped + failed
+            album.count("skipped", skipped)
+            album.count("failed", failed)
+        if skipped:
+            metrics.inc("files_total", skipped, host=urlparse(album.adapter.url).netloc, result="skipped")
+        if failed:
+            metrics.inc("files_total", failed, host=urlparse(album.adapter.url).netloc, result="failed")
+
+    def close(self, album):
+        with self.cond:
+            album.listing_done = True
+            done = album.idle()
+        if done:
+            album.on_done(album)
+
+    def hold(self, album, held):
+        with self.cond:
+            album.held = held
+            self.cond.notify_all()
+
+    def cancel(self, album):
+        # Drops the album's waiting files; files in flight finish and the lister stops
+        with self.cond:
+            album.cancelled = True
+            dropped = len(album.pending)
+            album.pending.clear()
+            if album.queued:
+                album.queued = False
+                self.albums.remove(album)
+            album.count("cancelled", dropped)
+            done = album.idle()
+        for _ in range(dropped):
+            album.room.release()
+        if done:
+            album.on_done(album)
+
+    def _next_job(self):
+        # Highest priority first, then earliest deadline; albums that tie take turns
+        for album in sorted(self.albums, key=AlbumJob.rank):
+            if album.held:
+                continue
+            host = album.host_of(album.pending[0])
+            cap = rate_control.limit(host)
+            if self.per_host > 0:
+                cap = min(cap, self.per_host * max(1, len(proxy_pool.proxies)))
+            if self.host_active[host] >= cap:
+                continue
+            file = album.pending.popleft()
+            album.room.release()
+            self.albums.remove(album)
+            if album.pending:
+                self.albums.append(album)
+            else:
+                album.queued = False
+            album.in_flight += 1
+            self.host_active[host] += 1
+            return album, file, host
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = self._next_job()
+                while job is None:
+                    self.cond.wait()
+                    job = self._next_job()
+            album, file, host = job
+            started = time.monotonic()
+            with tracer.span("file", "file", file=file.get("name"), album=album.name) as span:
+                try:
+                    result = run_dispatched(album.straggler(file, self.workers), album.adapter.download_file,
+                                            file, album.output_dir)
+                except Exception as e:
+                    print(f"\n❌ Error downloading {file.get('name')}: {e}")
+                    result = "failed"
+                span.set(result=result)
+            with self.cond:
+                self.host_active[host] -= 1
+                album.in_flight -= 1
+                album.record(file, result, time.monotonic() - started)
+                done = album.idle()
+                self.cond.notify_all()
+            album.file_done(file, result)
+            if done:
+                album.on_done(album)
+
+# =============================
+# ASYNCIO ENGINE
+# =============================
+class AsyncEngine:
+    # Drop-in for Scheduler that runs every file as a task on one event loop, so
+    # hundreds of small transfers can be in flight without a thread each. Transfers
+    # described by adapter.resolve() run natively; adapters without it, and files big
+    # enough to segment, run their usual download_file on a thread.
+    def __init__(self, max_in_flight=ASYNC_MAX_IN_FLIGHT, per_host=0):
+        global asyncio
+        import asyncio
+        try:
+            import aiohttp
+        except ImportError:
+            raise SystemExit("The asyncio engine needs aiohttp: pip install aiohttp")
+        self.aiohttp = aiohttp
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self._run_loop, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._setup())
+        ready.set()
+        self.loop.run_forever()
 
-    def get_album_name(self):
-        raise NotImplementedError
+    async def _setup(self):
+        self.albums = set()
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.host_cond = asyncio.Condition()
+        self.host_active = collections.Counter()
+        self.session = self.aiohttp.ClientSession(
+            connector=self.aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=self.aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=60),
+        )
 
-    def get_files(self):
-        raise NotImplementedError
+    # open/feed/close are called from lister threads; album state is only
+    # touched on the loop thread
+    def open(self, album):
+        asyncio.run_coroutine_threadsafe(self._run_album(album), self.loop)
 
-    def download_file(self, file, output_dir):
-        raise NotImplementedError
+    def feed(self, album, files, skipped=0, failed=0):
+        for file in files:
+            album.room.acquire()
+            self.loop.call_soon_threadsafe(self._add, album, [file], 0)
+        self.loop.call_soon_threadsafe(self._add, album, [], len(files) + skipped + failed, skipped, failed)
 
-# -----------------------------
-# Pixeldrain Adapter
-# -----------------------------
-class PixeldrainAdapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        parsed = urlparse(url)
-        parts = parsed.path.strip("/").split("/")
-        if len(parts) >= 2 and parts[0] == "l":
-            self.album_id = parts[1]
-        else:
-            raise ValueError("Invalid Pixeldrain URL")
+    def close(self, album):
+        self.loop.call_soon_threadsafe(self._close, album)
 
-    def get_album_name(self):
-        r = requests.get(f"https://pixeldrain.com/api/list/{self.album_id}", headers=HEADERS, proxies=self.proxies)
-        r.raise_for_status()
-        j = r.json()
-        return safe_name(j.get("name") or j.get("title") or f"Pixeldrain_{self.album_id}")
+    def hold(self, album, held):
+        album.held = held
+        self.loop.call_soon_threadsafe(lambda: self._wakeup(album).set())
 
-    def get_files(self):
-        r = requests.get(f"https://pixeldrain.com/api/list/{self.album_id}", headers=HEADERS, proxies=self.proxies)
-        r.raise_for_status()
-        j = r.json()
-        return j.get("files", [])
+    def cancel(self, album):
+        self.loop.call_soon_threadsafe(self._cancel, album)
 
-    def download_file(self, file, output_dir):
-        file_id = file["id"]
-        name = file["name"]
-        size = file.get("size", 0)
+    def _wakeup(self, album):
+        if album.wakeup is None:
+            album.wakeup = asyncio.Event()
+        return album.wakeup
 
-        path = os.path.join(output_dir, name)
-        temp_path = path + ".part"
+    def _add(self, album, files, total, skipped=0, failed=0):
+        if album.cancelled and files:
+            album.count("cancelled", len(files))
+            for _ in files:
+                album.room.release()
+            files = []
+        album.pending.extend(files)
+        album.total += total
+        album.count("skipped", skipped)
+        album.count("failed", failed)
+        if skipped:
+            metrics.inc("files_total", skipped, host=urlparse(album.adapter.url).netloc, result="skipped")
+        if failed:
+            metrics.inc("files_total", failed, host=urlparse(album.adapter.url).netloc, result="failed")
+        self._wakeup(album).set()
 
-        # Check if existing file matches size
-        if os.path.exists(path) and size > 0 and os.path.getsize(path) == size:
-            return "skipped"
+    def _close(self, album):
+        album.listing_done = True
+        self._wakeup(album).set()
 
-        attempt = 0
-        while attempt < MAX_RETRIES:
+    def _cancel(self, album):
+        album.cancelled = True
+        dropped = len(album.pending)
+        album.pending.clear()
+        album.count("cancelled", dropped)
+        for _ in range(dropped):
+            album.room.release()
+        self._wakeup(album).set()
+
+    def _outranked(self, album):
+        rank = album.rank()
+        return any(other.rank() < rank and other.pending and not other.held for other in self.albums)
+
+    async def _run_album(self, album):
+        tasks = set()
+        self.albums.add(album)
+        while True:
+            if album.pending and not album.held:
+                if self._outranked(album):
+                    # An album with a higher priority or earlier deadline has files waiting
+                    await asyncio.sleep(0.05)
+                    continue
+                await self.slots.acquire()  # FIFO, so queued albums take turns
+                if album.held or not album.pending:
+                    self.slots.release()  # Paused or cancelled while waiting
+                    continue
+                file = album.pending.popleft()
+                album.room.release()
+                album.in_flight += 1
+                task = asyncio.ensure_future(self._run_file(album, file))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif album.listing_done and not album.pending:
+                break
+            else:
+                self._wakeup(album).clear()
+                await self._wakeup(album).wait()
+        if tasks:
+            await asyncio.wait(tasks)
+        self.albums.discard(album)
+        album.idle()
+        await self.loop.run_in_executor(None, album.on_done, album)
+
+    async def _run_file(self, album, file):
+        host = album.host_of(file)
+        started = time.monotonic()
+        # Tasks interleave on the loop thread, so their spans go on per-file tracks
+        track = f"{album.name}/{file.get('name')}"
+        try:
+            with tracer.span("host slot wait", "wait", track=track, host=host):
+                await self._acquire_host(host)
             try:
-                headers = HEADERS.copy()
-                headers["User-Agent"] = f"PixeldrainDownloader/2.1-{random.randint(1000,9999)}"
-                downloaded = 0
+                with tracer.span("file", "file", track=track, album=album.name) as span:
+                    straggler = album.straggler(file, self.per_host or self.max_in_flight)
+                    result = await self._download(album.adapter, file, album.output_dir, straggler)
+                    span.set(result=result)
+            finally:
+                await self._release_host(host)
+        except Exception as e:
+            print(f"\n❌ Error downloading {file.get('name')}: {e}")
+            result = "failed"
+        finally:
+            self.slots.release()
+        await self.loop.run_in_executor(None, album.file_done, file, result)
+        album.in_flight -= 1
+        album.record(file, result, time.monotonic() - started)
 
-                if os.path.exists(temp_path):
-                    downloaded = os.path.getsize(temp_path)
-                    headers["Range"] = f"bytes={downloaded}-"
+    async def _acquire_host(self, host):
+        async with self.host_cond:
+            while True:
+                cap = rate_control.limit(host)
+                if self.per_host > 0:
+                    cap = min(cap, self.per_host * max(1, len(proxy_pool.proxies)))
+                if self.host_active[host] < cap:
+                    break
+                try:
+                    # Wake up now and then: the controller may have raised the cap
+                    await asyncio.wait_for(self.host_cond.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+            self.host_active[host] += 1
 
-                url = f"https://pixeldrain.com/api/file/{file_id}"
-                with requests.get(url, headers=headers, stream=True, timeout=60, proxies=self.proxies) as r:
-                    r.raise_for_status()
-                    total_size = size if size > 0 else int(r.headers.get("Content-Length", 0)) + downloaded
-                    mode = "ab" if downloaded else "wb"
-
-                    with open(temp_path, mode) as f, tqdm(
-                        total=total_size,
-                        initial=downloaded,
-                        unit="B",
-                        unit_scale=True,
-                        desc=name,
-                        leave=False
-                    ) as bar:
-                        for chunk in r.iter_content(8192):
-                            if not chunk:
-                                continue
-
-                            # PAUSE HANDLING
-                            while not pause_event.is_set():
-                                time.sleep(0.2)
+    async def _release_host(self, host):
+        async with self.host_cond:
+            self.host_active[host] -= 1
+            self.host_cond.notify_all()
 
-                            f.write(chunk)
-                            bar.update(len(chunk))
+    async def _request(self, adapter, method, url, headers):
+        if not proxy_pool.proxies:
+            return await self._send(adapter, method, url, headers, None)
+        tried = []
+        while True:
+            pooled = proxy_pool.pick(urlparse(url).netloc, tried)
+            tried.append(pooled)
+            try:
+                resp = await self._send(adapter, method, url, headers, pooled)
+            except (self.aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not proxy_pool.failover(tried):
+                    raise
+                continue
+            # 407 and 502 come from the proxy itself
+            if resp.status not in (407, 502) or not proxy_pool.failover(tried):
+                return resp
+            resp.release()
 
-                os.replace(temp_path, path)
-                time.sleep(RATE_DELAY + random.uniform(0.1, 0.5))
-                return "downloaded"
+    async def _send(self, adapter, method, url, headers, pooled):
+        host = urlparse(url).netloc
+        ctl = rate_control.get(proxy_pool.route(pooled, host))
+        delay = ctl.reserve()
+        if delay > 0:
+            with tracer.span("request spacing / 429 hold", "wait", track=url, host=host):
+                await asyncio.sleep(delay)
+        proxy = pooled.url if pooled else (adapter.proxies or {}).get(urlparse(url).scheme)
+        metrics.inc("requests_total", host=host)
+        started = time.monotonic()
+        try:
+            with tracer.span(f"{method} (connect + TTFB)", "http", track=url, host=host):
+                resp = await self.session.request(method, url, headers=headers, proxy=proxy,
+                                                  allow_redirects=method != "HEAD")
+        except Exception:
+            metrics.inc("request_errors_total", host=host)
+            proxy_pool.release(pooled, ok=False)
+            raise
+        metrics.observe("ttfb_seconds", time.monotonic() - started, host=host)
+        resp.proxy = pooled
+        proxy_pool.release(pooled, ok=resp.status not in (407, 502), throttled=resp.status == 429)
+        if resp.status == 429:
+            metrics.inc("throttled_total", host=host)
+            wait = ctl.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+            print(f"\n⚠ Rate limit (429) from {host}, holding it for {wait:.1f}s: {ctl.snapshot()}")
+        elif resp.status < 400:
+            ctl.on_success()
+        return resp
 
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    wait = 60 + random.uniform(10, 20)  # Longer for rate limit
-                    print(f"\n⚠ Rate limit (429) on {name}, waiting {wait:.1f}s")
-                    time.sleep(wait)
-                else:
+    async def _download(self, adapter, file, output_dir, straggler=False):
+        target = adapter.resolve(file, output_dir)
+        if target is None:
+            return await self.loop.run_in_executor(None, run_dispatched, straggler, adapter.download_file,
+                                                   file, output_dir)
+        if store.enabled:
+            placed = await self.loop.run_in_executor(None, store.checkout, target["key"], target["sha256"],
+                                                     target["path"])
+            if placed:
+                return placed
+        if target["probe"]:
+            try:
+                async with await self._request(adapter, "HEAD", target["url"], HEADERS) as head:
+                    skip, target["size"] = await self.loop.run_in_executor(
+                        None, adapter._judge_copy, file, target["path"], head.headers)
+            except Exception:
+                skip = False
+            if skip:
+                return "skipped"
+        elif local_copy_matches(target):
+            await self.loop.run_in_executor(None, manifest.record, target["key"], target["path"], target["size"])
+            return "skipped"
+
+        if SEGMENTS > 1 and target["size"] >= (STRAGGLER_MIN_SIZE if straggler else SEGMENT_MIN_SIZE):
+            return await self.loop.run_in_executor(None, lambda: run_dispatched(straggler, lambda: adapter._download(
+                target["url"], target["path"], target["name"], target["size"], target["headers"],
+                key=target["key"], sha256=target["sha256"])))
+
+        name = target["name"]
+        path = target["path"]
+        host = urlparse(target["url"]).netloc
+        for check in range(2):
+            digest = StreamHash()
+            attempt = 0
+            while attempt < MAX_RETRIES:
+                try:
+                    seen = await self._stream(adapter, target, digest)
+                    break
+                except MirrorSwitch as e:
+                    print(f"\n⚠ {name}: {e}")
+                except self.aiohttp.ClientResponseError as e:
+                    metrics.inc("retries_total", host=host)
+                    if e.status == 429:
+                        continue  # The host's controller holds the next request
                     attempt += 1
                     wait = 2 ** attempt + random.uniform(0.5, 1.5)
                     print(f"\n⚠ HTTP error on {name}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                    time.sleep(wait)
-            except Exception as e:
-                attempt += 1
-                wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                time.sleep(wait)
-
-        print(f"\n❌ Gave up on {name}")
-        return "failed"
+                    with tracer.span("retry backoff", "wait", track=target["url"], attempt=attempt):
+                        await asyncio.sleep(wait)
+                except Exception as e:
+                    metrics.inc("retries_total", host=host)
+                    attempt += 1
+                    wait = 2 ** attempt + random.uniform(0.5, 1.5)
+                    print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
+                    with tracer.span("retry backoff", "wait", track=target["url"], attempt=attempt):
+                        await asyncio.sleep(wait)
+            else:
+                metrics.inc("gave_up_total", host=host)
+                print(f"\n❌ Gave up on {name}")
+                return "failed"
 
-# -----------------------------
-# Bunkr Adapter
-# -----------------------------
-class BunkrAdapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        self.album_id = url.rstrip("/").split("/")[-1]
+            expected = await self.loop.run_in_executor(None, expected_digest, target["key"], target["sha256"], seen)
+            actual = digest.hexdigest()
+            if not expected or not actual or actual == expected.lower():
+                break
+            print(f"\n❌ Checksum mismatch on {name}, fetching it again")
+            os.remove(path + ".part")
+        else:
+            return "failed"
 
-    def get_album_name(self):
-        r = requests.get(self.url, headers=HEADERS, proxies=self.proxies)
-        return safe_name(f"Bunkr_{self.album_id}")
+        os.replace(path + ".part", path)
+        actual = actual if digest.algo == "sha256" else None
+        if store.enabled:
+            # Hashing a file the transfer did not hash blocks, so it runs off the loop
+            actual = await self.loop.run_in_executor(None, store.add, target["key"], path, actual)
+        # So can the manifest's SQLite commit
+        await self.loop.run_in_executor(None, manifest.record, target["key"], path, os.path.getsize(path),
+                                        seen.get("etag"), seen.get("last_modified"), actual)
+        return "downloaded"
 
-    def get_files(self):
-        r = requests.get(self.url, headers=HEADERS, proxies=self.proxies)
-        r.raise_for_status()
-        links = re.findall(r'https://files\.bunkr\.\w+/[^\s"\']+', r.text)
-        files = [{"id": l.split("/")[-1], "name": l.split("/")[-1], "size": 0, "url": l} for l in links]
-        return files
+    async def _stream(self, adapter, target, digest):
+        if adapter.mirrors is None:
+            return await self._stream_from(adapter, target, digest, target["url"])
+        # Same as SiteAdapter._via_mirror; probing blocks, so it runs off the loop
+        url = await self.loop.run_in_executor(None, adapter.mirrors.pick, target["url"], adapter._get)
+        try:
+            return await self._stream_from(adapter, target, digest, url)
+        except Exception as e:
+            adapter.mirrors.fail_over(url, e)
+            raise
 
-    def download_file(self, file, output_dir):
-        url = file["url"]
-        name = file["name"]
-        path = os.path.join(output_dir, name)
-        temp_path = path + ".part"
+    async def _stream_from(self, adapter, target, digest, url):
+        temp_path = target["path"] + ".part"
+        host = urlparse(url).netloc
+        headers = dict(target["headers"])
+        downloaded = 0
 
-        # Check existing file size with HEAD request
-        try:
-            head = requests.head(url, headers=HEADERS, proxies=self.proxies)
-            size = int(head.headers.get("Content-Length", 0))
-            if os.path.exists(path) and os.path.getsize(path) == size:
-                return "skipped"
-        except Exception:
-            size = 0
+        if os.path.exists(temp_path):
+            downloaded = os.path.getsize(temp_path)
+            headers["Range"] = f"bytes={downloaded}-"
 
-        attempt = 0
-        while attempt < MAX_RETRIES:
+        async with await self._request(adapter, "GET", url, headers) as resp:
+            resp.raise_for_status()
+            if downloaded and resp.status != 206:
+                downloaded = 0  # Range ignored, the body is the whole file
+            await self.loop.run_in_executor(None, digest.resume, temp_path, downloaded)
+            total_size = target["size"] or (resp.content_length or 0) + downloaded
+            bar = progress.start_file(target["name"], total_size, downloaded)
+            received = 0
+            watch = adapter.mirrors.watch(url) if adapter.mirrors else None
+            proxy_pool.streaming(resp.proxy, True)
+            started = time.monotonic()
+            f = WriteBehindFile(temp_path, "ab" if downloaded else "wb")
             try:
-                headers = HEADERS.copy()
-                downloaded = 0
+                with tracer.span("transfer", "file", track=url, offset=downloaded):
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        # PAUSE HANDLING
+                        while not pause_event.is_set():
+                            await asyncio.sleep(0.2)
 
-                if os.path.exists(temp_path):
-                    downloaded = os.path.getsize(temp_path)
-                    headers["Range"] = f"bytes={downloaded}-"
+                        if f.full():
+                            # Waiting for the disk's writer must not hold up the loop
+                            await self.loop.run_in_executor(None, f.write, chunk)
+                        else:
+                            f.write(chunk)
+                        digest.update(chunk)
+                        bar.update(len(chunk))
+                        received += len(chunk)
+                        delay = limiter.delay(host, len(chunk))
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        if watch is not None:
+                            watch.update(len(chunk), delay)
+            except BaseException as e:
+                # Closing waits for the writer, so it runs off the loop; a retry must not
+                # size up the .part before the last writes are in it
+                await self.loop.run_in_executor(None, f.__exit__, type(e), e, None)
+                raise
+            else:
+                await self.loop.run_in_executor(None, f.close)
+            finally:
+                bar.close()
+                metrics.inc("bytes_total", received, host=host)
+                proxy_pool.streaming(resp.proxy, False)
+                proxy_pool.observe(resp.proxy, received, time.monotonic() - started)
+            if watch is not None:
+                watch.done()
+            return validators(resp)
 
-                with requests.get(url, headers=headers, stream=True, timeout=60, proxies=self.proxies) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get("Content-Length", 0)) + downloaded
-                    mode = "ab" if downloaded else "wb"
-
-                    with open(temp_path, mode) as f, tqdm(
-                        total=total_size,
-                        initial=downloaded,
-                        unit="B",
-                        unit_scale=True,
-                        desc=name,
-                        leave=False
-                    ) as bar:
-                        for chunk in r.iter_content(8192):
-                            if not chunk:
-                                continue
-
-                            # PAUSE HANDLING
-                            while not pause_event.is_set():
-                                time.sleep(0.2)
+def batched(iterable):
+    # Batches of 1, 2, 4, ... up to 256 entries: the first files reach the workers at
+    # once, later manifest lookups are amortised over bigger batches
+    size, batch = 1, []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            size, batch = min(size * 2, 256), []
+    if batch:
+        yield batch
 
-                            f.write(chunk)
-                            bar.update(len(chunk))
+def queue_worker(status_cb=print, unzip=False, proxies=None, max_workers=MAX_WORKERS, per_host=PER_HOST_WORKERS, engine="threads",
+                 jobs=None):
+    rate_control.max_concurrency = per_host or max_workers
+    if engine == "async":
+        scheduler = AsyncEngine(max_workers, per_host)
+    else:
+        scheduler = Scheduler(max_workers, per_host)
 
-                os.replace(temp_path, path)
-                time.sleep(RATE_DELAY + random.uniform(0.1, 0.5))
-                return "downloaded"
+    extractor = Extractor(status_cb) if unzip else None
+    extract_lock = threading.Lock()
 
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    wait = 60 + random.uniform(10, 20)  # Longer for rate limit
-                    print(f"\n⚠ Rate limit (429) on {name}, waiting {wait:.1f}s")
-                    time.sleep(wait)
-                else:
-                    attempt += 1
-                    wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                    print(f"\n⚠ HTTP error on {name}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                    time.sleep(wait)
-            except Exception as e:
-                attempt += 1
-                wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                time.sleep(wait)
+    def release(album):
+        # The queue entry is done once the downloads and the album's extractions are
+        with extract_lock:
+            if not album.downloads_done or album.extracting or album.released:
+                return
+            album.released = True
+        album_queue.task_done()
 
-        print(f"\n❌ Gave up on {name}")
-        return "failed"
+    def extract(album, file, result):
+        path = os.path.join(album.output_dir, file["name"])
+        if result == "failed" or not path.endswith(".zip") or not os.path.exists(path):
+            return
+        with extract_lock:
+            album.extracting += 1
 
-# -----------------------------
-# K00 Adapter
-# -----------------------------
-class K00Adapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        self.album_id = url.rstrip("/").split("/")[-1]
+        def extracted():
+            with extract_lock:
+                album.extracting -= 1
+            release(album)
+        extractor.submit(path, album.output_dir, extracted)
 
-    def get_album_name(self):
-        return safe_name(f"K00_{self.album_id}")
+    def finish(album):
+        tracer.complete("album", "album", album.opened, track=album.name,
+                        args=dict(album.results, files=album.total))
+        try:
+            complete = album.results["downloaded"] + album.results["linked"] + album.results["skipped"]
+            linked = f"{album.results['linked']} linked from the store, " if album.results["linked"] else ""
+            cancelled = f", {album.results['cancelled']} cancelled" if album.results["cancelled"] else ""
+            status_cb(
+                f"Album '{album.name}' done: {album.results['downloaded']} downloaded, {linked}"
+                f"{album.results['skipped']} skipped, {album.results['failed']} failed{cancelled} "
+                f"({complete}/{album.total} complete)"
+            )
+        except Exception as e:
+            status_cb(f"Error: {e}")
+        progress.untrack_album(album)
+        disk_space.release(album)
+        if album.job is not None:
+            jobs.finished(album.job, album)
+        album.downloads_done = True
+        release(album)
 
-    def get_files(self):
-        r = requests.get(self.url, headers=HEADERS, proxies=self.proxies)
-        links = re.findall(r'https://k00\.fr/[^\s"\']+', r.text)
-        files = [{"id": l.split("/")[-1], "name": l.split("/")[-1], "size": 0, "url": l} for l in links]
-        return files
+    def list_album(item):
+        # Items are album URLs, or (url, job id) from the daemon's job queue
+        url, job = item if isinstance(item, tuple) else (item, None)
+        if job is not None and not jobs.claim(job):
+            album_queue.task_done()  # Paused or cancelled while it waited
+            return
+        opened = time.perf_counter()
+        try:
+            with tracer.span("resolve album", "listing", url=url):
+                adapter = get_adapter(url, proxies=proxies)
+                album_name = (job is not None and jobs.album_name(job)) or adapter.get_album_name()
+            output_dir = os.path.join(BASE_DIR, album_name)
+            os.makedirs(output_dir, exist_ok=True)
+        except Exception as e:
+            status_cb(f"Error: {e}")
+            if job is not None:
+                jobs.failed(job, str(e))
+            album_queue.task_done()
+            return
+        album = AlbumJob(album_name, adapter, output_dir, finish)
+        album.opened = opened
+        album.job = job
+        if job is not None:
+            album.priority, album.deadline = jobs.hints(job)
+        album.on_file.append(disk_space.settle)
+        if extractor is not None:
+            album.on_file.append(extract)
+        progress.track_album(album)
+        scheduler.open(album)
+        if job is not None:
+            jobs.opened(job, album, scheduler)
+        def todo_of(batch):
+            # The files of batch the manifest does not have as complete in this album
+            with tracer.span("manifest lookup", "listing", files=len(batch)):
+                done = set() if REVALIDATE else manifest.completed(adapter, batch, output_dir, album.known_sizes)
+            return [f for f in batch if adapter.file_key(f) not in done]
 
-    def download_file(self, file, output_dir):
-        url = file["url"]
-        name = file["name"]
-        path = os.path.join(output_dir, name)
-        temp_path = path + ".part"
+        def refuse(files, short):
+            # Files the disk has no room for settle as failed without starting; those
+            # already complete on disk count as skipped. Returns (skipped, failed).
+            status_cb(f"❌ Not enough free space for '{album_name}': {human_size(short)} more needed in {output_dir}")
+            need = disk_space.needs(album, files)
+            failed = [f for f in files if need.get(adapter.file_key(f)) != 0]
+            for file in failed:
+                album.file_done(file, "failed")
+            return len(files) - len(failed), len(failed)
 
-        # Check existing file size with HEAD request
         try:
-            head = requests.head(url, headers=HEADERS, proxies=self.proxies)
-            size = int(head.headers.get("Content-Length", 0))
-            if os.path.exists(path) and os.path.getsize(path) == size:
-                return "skipped"
-        except Exception:
-            size = 0
+            # Transfers start with the first entries while the rest is still listed.
+            # The listing span includes time blocked on a full pending queue.
+            with tracer.span("listing", "listing", album=album_name):
+                files = adapter.iter_files() if job is None else jobs.files(job, album)
+                if adapter.streams_listing:
+                    batches = ((batch, todo_of(batch)) for batch in batched(files))
+                else:
+                    # The whole listing is at hand, so the album is admitted before any file starts
+                    files = list(files)
+                    batches = [(files, todo_of(files))]
+                for batch, todo in batches:
+                    if album.cancelled:
+                        break
+                    short = disk_space.admit(album, todo)
+                    if short:
+                        # Listing stops here; the rest of the album would not fit either
+                        skipped, failed = refuse(todo, short)
+                        scheduler.feed(album, [], skipped=len(batch) - len(todo) + skipped, failed=failed)
+                        break
+                    scheduler.feed(album, todo, skipped=len(batch) - len(todo))
+        except Exception as e:
+            status_cb(f"Error listing '{album_name}': {e}")
+        finally:
+            scheduler.close(album)
 
-        attempt = 0
-        while attempt < MAX_RETRIES:
+    with ThreadPoolExecutor(max_workers=LISTING_WORKERS, thread_name_prefix="lister") as listers:
+        while True:
+            url = album_queue.get()
+            if url is None:
+                break
+            listers.submit(list_album, url)
+
+# =============================
+# DAEMON
+# =============================
+class JobQueue:
+    # Durable album and file state for --daemon, in BASE_DIR/.jobs.sqlite. Files are
+    # stored as they are listed, so after a restart an unfinished album carries on with
+    # its remaining files (resuming their .part files) without asking the host for the
+    # listing again, and finished albums stay finished.
+    def __init__(self, path=None):
+        self.path = path or os.path.join(BASE_DIR, ".jobs.sqlite")
+        self.lock = threading.Lock()
+        self.live = {}  # job id -> (AlbumJob, engine) while the album runs
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS albums (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, state TEXT, "
+            "name TEXT, listed INTEGER DEFAULT 0, error TEXT, created REAL, updated REAL, "
+            "priority INTEGER DEFAULT 0, deadline REAL)"
+        )
+        for column in ("priority INTEGER DEFAULT 0", "deadline REAL"):
             try:
-                headers = HEADERS.copy()
-                downloaded = 0
+                self.conn.execute(f"ALTER TABLE albums ADD COLUMN {column}")  # Queues from older versions
+            except sqlite3.OperationalError:
+                pass
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (album INTEGER, key TEXT, entry TEXT, state TEXT, UNIQUE (album, key))"
+        )
+        self.conn.commit()
 
-                if os.path.exists(temp_path):
-                    downloaded = os.path.getsize(temp_path)
-                    headers["Range"] = f"bytes={downloaded}-"
+    def _sql(self, sql, *args):
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+            self.conn.commit()
+        return rows
 
-                with requests.get(url, headers=headers, stream=True, timeout=60, proxies=self.proxies) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get("Content-Length", 0)) + downloaded
-                    mode = "ab" if downloaded else "wb"
-
-                    with open(temp_path, mode) as f, tqdm(
-                        total=total_size,
-                        initial=downloaded,
-                        unit="B",
-                        unit_scale=True,
-                        desc=name,
-                        leave=False
-                    ) as bar:
-                        for chunk in r.iter_content(8192):
-                            if not chunk:
-                                continue
-
-                            # PAUSE HANDLING
-                            while not pause_event.is_set():
-                                time.sleep(0.2)
+    def _set(self, job, **fields):
+        fields["updated"] = time.time()
+        self._sql(f"UPDATE albums SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?", *fields.values(), job)
 
-                            f.write(chunk)
-                            bar.update(len(chunk))
+    def start(self):
+        # Albums a previous run left running go back in the queue, in submission order
+        self._sql("UPDATE albums SET state = 'queued' WHERE state = 'running'")
+        for job, url in self._sql("SELECT id, url FROM albums WHERE state = 'queued' ORDER BY priority DESC, id"):
+            album_queue.put((url, job))
 
-                os.replace(temp_path, path)
-                time.sleep(RATE_DELAY + random.uniform(0.1, 0.5))
-                return "downloaded"
+    def submit(self, url, priority=0, deadline=None):
+        # The same URL still waiting or running is not queued twice. deadline is epoch
+        # seconds; both only order albums against each other, nothing is dropped.
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id FROM albums WHERE url = ? AND state IN ('queued', 'running', 'paused')", (url,)
+            ).fetchone()
+            if row:
+                return row[0]
+            now = time.time()
+            job = self.conn.execute(
+                "INSERT INTO albums (url, state, created, updated, priority, deadline) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (url, now, now, priority, deadline)
+            ).lastrowid
+            self.conn.commit()
+        album_queue.put((url, job))
+        return job
 
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    wait = 60 + random.uniform(10, 20)  # Longer for rate limit
-                    print(f"\n⚠ Rate limit (429) on {name}, waiting {wait:.1f}s")
-                    time.sleep(wait)
-                else:
-                    attempt += 1
-                    wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                    print(f"\n⚠ HTTP error on {name}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                    time.sleep(wait)
-            except Exception as e:
-                attempt += 1
-                wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                time.sleep(wait)
+    def claim(self, job):
+        with self.lock:
+            claimed = self.conn.execute(
+                "UPDATE albums SET state = 'running', error = NULL, updated = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), job)
+            ).rowcount
+            self.conn.commit()
+        return claimed == 1
 
-        print(f"\n❌ Gave up on {name}")
-        return "failed"
+    def hints(self, job):
+        rows = self._sql("SELECT priority, deadline FROM albums WHERE id = ?", job)
+        return (rows[0][0] or 0, rows[0][1]) if rows else (0, None)
 
-# -----------------------------
-# SingleFile Adapter
-# -----------------------------
-class SingleFileAdapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        self.name = urlparse(url).path.split("/")[-1] or "file"
+    def album_name(self, job):
+        rows = self._sql("SELECT name FROM albums WHERE id = ?", job)
+        return rows[0][0] if rows else None
 
-    def get_album_name(self):
-        return safe_name(f"Single_{self.name}")
+    def opened(self, job, album, engine):
+        with self.lock:
+            self.live[job] = (album, engine)
+        self._set(job, name=album.name)
+        album.on_file.append(self.file_done)
+        # Paused or cancelled between claim() and here
+        state = self._sql("SELECT state FROM albums WHERE id = ?", job)[0][0]
+        if state == "paused":
+            engine.hold(album, True)
+        elif state == "cancelled":
+            engine.cancel(album)
 
-    def get_files(self):
-        return [{"id": self.name, "name": self.name, "size": 0, "url": self.url}]
+    def files(self, job, album):
+        # The stored files still to do when the album was listed before; otherwise the
+        # live listing, each entry stored before it is handed out
+        if self._sql("SELECT listed FROM albums WHERE id = ?", job)[0][0]:
+            for (entry,) in self._sql("SELECT entry FROM files WHERE album = ? AND state = 'pending' ORDER BY rowid", job):
+                yield json.loads(entry)
+            return
+        for entry in album.adapter.iter_files():
+            key = album.adapter.file_key(entry)
+            with self.lock:
+                self.conn.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, 'pending')", (job, key, json.dumps(entry)))
+                state = self.conn.execute("SELECT state FROM files WHERE album = ? AND key = ?", (job, key)).fetchone()[0]
+                self.conn.commit()
+            if state == "pending":
+                yield entry
+        if not album.cancelled:
+            self._set(job, listed=1)
 
-    def download_file(self, file, output_dir):
-        url = file["url"]
-        name = file["name"]
-        path = os.path.join(output_dir, name)
-        temp_path = path + ".part"
+    def file_done(self, album, file, result):
+        self._sql("UPDATE files SET state = ? WHERE album = ? AND key = ?", result, album.job, album.adapter.file_key(file))
 
-        try:
-            head = requests.head(url, headers=HEADERS, proxies=self.proxies)
-            size = int(head.headers.get("Content-Length", 0))
-            if os.path.exists(path) and os.path.getsize(path) == size:
-                return "skipped"
-        except Exception:
-            size = 0
+    def finished(self, job, album):
+        # Files never handed to a worker were skipped by the manifest, or dropped by a cancel
+        self._sql("UPDATE files SET state = ? WHERE album = ? AND state = 'pending'",
+                  "cancelled" if album.cancelled else "skipped", job)
+        state = "cancelled" if album.cancelled else "failed" if album.results["failed"] else "done"
+        self._set(job, state=state)
+        with self.lock:
+            self.live.pop(job, None)
 
-        attempt = 0
-        while attempt < MAX_RETRIES:
+    def failed(self, job, error):
+        self._set(job, state="failed", error=error)
+
+    def control(self, job, action):
+        # pause / resume / cancel; returns the job, None if unknown, or raises ValueError
+        rows = self._sql("SELECT state, url FROM albums WHERE id = ?", job)
+        if not rows:
+            return None
+        state, url = rows[0]
+        with self.lock:
+            album, engine = self.live.get(job, (None, None))
+        if action == "pause" and state in ("queued", "running"):
+            self._set(job, state="paused")
+            if album is not None:
+                engine.hold(album, True)
+        elif action == "resume" and state in ("paused", "failed"):
+            if album is not None:
+                self._set(job, state="running")
+                engine.hold(album, False)
+            else:
+                # Failed files get another try; the album goes back in the queue
+                self._sql("UPDATE files SET state = 'pending' WHERE album = ? AND state = 'failed'", job)
+                self._set(job, state="queued")
+                album_queue.put((url, job))
+        elif action == "cancel" and state in ("queued", "running", "paused"):
+            self._set(job, state="cancelled")
+            if album is not None:
+                engine.hold(album, False)
+                engine.cancel(album)
+        else:
+            raise ValueError(f"cannot {action} a {state} job")
+        return self.get(job)
+
+    def get(self, job, files=False):
+        rows = self._sql("SELECT id, url, state, name, error, created, updated, priority, deadline FROM albums "
+                         "WHERE id = ?", job)
+        if not rows:
+            return None
+        return self._describe(rows[0], files)
+
+    def list_jobs(self):
+        rows = self._sql("SELECT id, url, state, name, error, created, updated, priority, deadline FROM albums ORDER BY id")
+        return [self._describe(row) for row in rows]
+
+    def _describe(self, row, files=False):
+        job = dict(zip(("id", "url", "state", "name", "error", "created", "updated", "priority", "deadline"), row))
+        job["files"] = dict(self._sql("SELECT state, COUNT(*) FROM files WHERE album = ? GROUP BY state", job["id"]))
+        with self.lock:
+            album = self.live.get(job["id"], (None,))[0]
+        if album is not None:
+            job["in_flight"] = album.in_flight
+        if files:
+            job["results"] = [{"name": json.loads(entry).get("name"), "key": key, "state": state} for key, entry, state in
+                              self._sql("SELECT key, entry, state FROM files WHERE album = ? ORDER BY rowid", job["id"])]
+        return job
+
+def serve_api(jobs, port, host="127.0.0.1"):
+    # GET /jobs, GET /jobs/<id>[?files=1], POST /jobs {"urls": [...], "priority": 0,
+    # "deadline": <seconds from now>}, POST /jobs/<id>/pause|resume|cancel
+    import http.server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def _reply(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self):
+            path, _, query = self.path.partition("?")
+            parts = path.strip("/").split("/")
+            if parts[0] != "jobs" or len(parts) > 3 or (len(parts) > 1 and not parts[1].isdigit()):
+                return None, None, query
+            return (int(parts[1]) if len(parts) > 1 else None), (parts[2] if len(parts) > 2 else None), query
+
+        def do_GET(self):
+            job, action, query = self._route()
+            if self.path.split("?")[0].strip("/") == "jobs":
+                return self._reply(200, jobs.list_jobs())
+            if job is None or action is not None:
+                return self._reply(404, {"error": "unknown endpoint"})
+            found = jobs.get(job, files="files=1" in query)
+            if found is None:
+                return self._reply(404, {"error": "no such job"})
+            self._reply(200, found)
+
+        def do_POST(self):
+            job, action, _ = self._route()
+            if self.path.split("?")[0].strip("/") == "jobs":
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    urls = body.get("urls") or [body["url"]]
+                    priority = int(body.get("priority", 0))
+                    deadline = time.time() + float(body["deadline"]) if body.get("deadline") is not None else None
+                except (ValueError, KeyError, AttributeError, TypeError):
+                    return self._reply(400, {"error": 'expected {"urls": [...]} or {"url": "..."}'})
+                return self._reply(201, {"jobs": [jobs.submit(url.strip(), priority, deadline)
+                                                  for url in urls if url.strip()]})
+            if job is None or action not in ("pause", "resume", "cancel"):
+                return self._reply(404, {"error": "unknown endpoint"})
             try:
-                headers = HEADERS.copy()
-                downloaded = 0
+                found = jobs.control(job, action)
+            except ValueError as e:
+                return self._reply(409, {"error": str(e)})
+            if found is None:
+                return self._reply(404, {"error": "no such job"})
+            self._reply(200, found)
 
-                if os.path.exists(temp_path):
-                    downloaded = os.path.getsize(temp_path)
-                    headers["Range"] = f"bytes={downloaded}-"
+        def log_message(self, *args):
+            pass
 
-                with requests.get(url, headers=headers, stream=True, timeout=60, proxies=self.proxies) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get("Content-Length", 0)) + downloaded
-                    mode = "ab" if downloaded else "wb"
-
-                    with open(temp_path, mode) as f, tqdm(
-                        total=total_size,
-                        initial=downloaded,
-                        unit="B",
-                        unit_scale=True,
-                        desc=name,
-                        leave=False
-                    ) as bar:
-                        for chunk in r.iter_content(8192):
-                            if not chunk:
-                                continue
-
-                            # PAUSE HANDLING
-                            while not pause_event.is_set():
-                                time.sleep(0.2)
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
 
-                            f.write(chunk)
-                            bar.update(len(chunk))
+# =============================
+# WORKER MODE
+# =============================
+class WorkQueue:
+    # Album and file jobs shared by --worker processes through one SQLite file, which
+    # may live on a directory several hosts mount. A worker leases what it takes for
+    # LEASE_SECONDS and renews it by heartbeat; when a worker dies its leases run out
+    # and the next worker to ask takes its files over, resuming their .part files.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.lock_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")  # WAL needs shared memory, which network mounts lack
 
-                os.replace(temp_path, path)
-                time.sleep(RATE_DELAY + random.uniform(0.1, 0.5))
-                return "downloaded"
+        def create(db):
+            db.execute("CREATE TABLE IF NOT EXISTS albums (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, "
+                       "state TEXT, name TEXT, worker TEXT, lease_until REAL, error TEXT)")
+            # path is relative to BASE_DIR, so hosts may mount the directory in different places
+            db.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, album INTEGER, "
+                       "path TEXT UNIQUE, entry TEXT, state TEXT, worker TEXT, lease_until REAL, leases INTEGER DEFAULT 0)")
+            db.execute("CREATE INDEX IF NOT EXISTS files_by_state ON files (state, lease_until)")
+            db.execute("CREATE INDEX IF NOT EXISTS files_by_album ON files (album, state)")
+        self._write(create)
 
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    wait = 60 + random.uniform(10, 20)  # Longer for rate limit
-                    print(f"\n⚠ Rate limit (429) on {name}, waiting {wait:.1f}s")
-                    time.sleep(wait)
-                else:
-                    attempt += 1
-                    wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                    print(f"\n⚠ HTTP error on {name}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                    time.sleep(wait)
-            except Exception as e:
-                attempt += 1
-                wait = 2 ** attempt + random.uniform(0.5, 1.5)
-                print(f"\n❌ Error downloading {name}: {e}, retry {attempt}/{MAX_RETRIES} in {wait:.1f}s")
-                time.sleep(wait)
+    def _write(self, fn):
+        # One IMMEDIATE transaction, so concurrent workers queue up on the database lock
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return result
 
-        print(f"\n❌ Gave up on {name}")
-        return "failed"
+    def _read(self, sql, *args):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
 
-# -----------------------------
-# AnonFiles Adapter
-# -----------------------------
-class AnonFilesAdapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        parsed = urlparse(url)
-        self.file_id = parsed.path.strip("/").split("/")[-1]
+    def submit(self, url):
+        self._write(lambda db: db.execute("INSERT OR IGNORE INTO albums (url, state) VALUES (?, 'queued')", (url,)))
 
-    def get_album_name(self):
-        return safe_name(f"AnonFiles_{self.file_id}")
+    def lease_album(self, worker):
+        # (id, url) of an album nobody is listing, or None
+        def fn(db):
+            row = db.execute(
+                "SELECT id, url FROM albums WHERE state = 'queued' OR (state = 'listing' AND lease_until < ?) "
+                "ORDER BY id LIMIT 1", (time.time(),)
+            ).fetchone()
+            if row:
+                db.execute("UPDATE albums SET state = 'listing', worker = ?, lease_until = ? WHERE id = ?",
+                           (worker, time.time() + LEASE_SECONDS, row[0]))
+            return row
+        return self._write(fn)
 
-    def get_files(self):
-        r = requests.get(f"https://api.anonfiles.com/v2/file/{self.file_id}/info", headers=HEADERS, proxies=self.proxies)
-        r.raise_for_status()
-        j = r.json()
-        if not j.get("status"):
-            raise ValueError("Invalid AnonFiles URL")
-        file_info = j["data"]["file"]
-        return [{"id": self.file_id, "name": file_info["metadata"]["name"], "size": file_info["metadata"]["size"]["bytes"], "url": file_info["url"]["full"]}]
+    def add_files(self, album, name, files, done):
+        # A path already in the queue (the same album twice, or a re-listing after
+        # a lister died) is not added again
+        rows = [(album, "/".join([name] + f["name"].split("/")), json.dumps(f), "skipped" if d else "pending")
+                for f, d in zip(files, done)]
+        self._write(lambda db: db.executemany(
+            "INSERT OR IGNORE INTO files (album, path, entry, state) VALUES (?, ?, ?, ?)", rows))
 
-    def download_file(self, file, output_dir):
-        # Reuse SingleFileAdapter's download logic for consistency
-        single_adapter = SingleFileAdapter(file["url"], proxies=self.proxies)
-        return single_adapter.download_file(file, output_dir)
+    def listed(self, album, name):
+        def fn(db):
+            db.execute("UPDATE albums SET state = 'listed', name = ?, worker = NULL WHERE id = ?", (name, album))
+            return self._complete(db, album)
+        return self._write(fn)
 
-# -----------------------------
-# Mega Adapter
-# -----------------------------
-class MegaAdapter(SiteAdapter):
-    def __init__(self, url, proxies=None):
-        super().__init__(url, proxies)
-        # Note: Mega may not support proxies directly; handle if needed
-        self.mega = Mega().login_anonymous()
+    def album_failed(self, album, error):
+        self._write(lambda db: db.execute(
+            "UPDATE albums SET state = 'failed', error = ?, worker = NULL WHERE id = ?", (error, album)))
 
-    def get_album_name(self):
-        # For simplicity, use URL hash as name
-        parsed = urlparse(self.url)
-        return safe_name(f"Mega_{parsed.fragment or 'file'}")
+    def lease_files(self, worker, n):
+        # Up to n files that are pending or whose worker stopped renewing them
+        if n <= 0:
+            return []
 
-    def get_files(self):
-        # Mega URLs are typically single files/folders; assume single for now
-        return [{"id": "mega_file", "name": os.path.basename(self.url), "size": 0, "url": self.url}]
+        def fn(db):
+            now = time.time()
+            db.execute("UPDATE files SET state = 'failed', worker = NULL "
+                       "WHERE state = 'leased' AND lease_until < ? AND leases >= ?", (now, MAX_LEASES))
+            rows = db.execute(
+                "SELECT files.id, files.path, files.entry, albums.url FROM files JOIN albums ON albums.id = files.album "
+                "WHERE files.state = 'pending' OR (files.state = 'leased' AND files.lease_until < ?) "
+                "ORDER BY files.id LIMIT ?", (now, n)
+            ).fetchall()
+            db.executemany("UPDATE files SET state = 'leased', worker = ?, lease_until = ?, leases = leases + 1 "
+                           "WHERE id = ?", [(worker, now + LEASE_SECONDS, row[0]) for row in rows])
+            return [{"id": i, "path": path, "entry": json.loads(entry), "url": url} for i, path, entry, url in rows]
+        return self._write(fn)
 
-    def download_file(self, file, output_dir):
-        name = file["name"]
-        path = os.path.join(output_dir, name)
-        if os.path.exists(path):
-            return "skipped"
-        try:
-            self.mega.download_url(self.url, dest_path=output_dir)
-            return "downloaded"
-        except Exception as e:
-            print(f"\n❌ Error downloading {name} from Mega: {e}")
-            return "failed"
+    def renew(self, worker, files, albums):
+        until = time.time() + LEASE_SECONDS
 
-# =============================
-# ADAPTER FACTORY
-# =============================
-BUNKR_DOMAINS = [
-    "bunkr.me",
-    "bunkr.cr",
-    "bunkr.site",
-    "bunkr.si",
-    "bunkr.fi"
-]
+        def fn(db):
+            # Files by id alone: whoever holds a target's lock owns it, even if another
+            # worker took the lease over while this one was stalled
+            db.executemany("UPDATE files SET worker = ?, lease_until = ? WHERE id = ? AND state = 'leased'",
+                           [(worker, until, i) for i in files])
+            db.executemany("UPDATE albums SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'listing'",
+                           [(until, i, worker) for i in albums])
+        self._write(fn)
 
-def get_adapter(url, proxies=None):
-    parsed = urlparse(url)
-    netloc = parsed.netloc
-    path_parts = parsed.path.strip("/").split("/")
-    if "pixeldrain.com" in netloc:
-        if len(path_parts) >= 2 and path_parts[0] == "l":
-            return PixeldrainAdapter(url, proxies=proxies)
-        elif len(path_parts) >= 2 and path_parts[0] == "u":
-            return SingleFileAdapter(url, proxies=proxies)  # Single file on Pixeldrain
-    elif netloc in BUNKR_DOMAINS:
-        return BunkrAdapter(url, proxies=proxies)
-    elif "k00.fr" in netloc:
-        return K00Adapter(url, proxies=proxies)
-    elif "anonfiles.com" in netloc:
-        return AnonFilesAdapter(url, proxies=proxies)
-    elif "mega.nz" in netloc or "mega.co.nz" in netloc:
-        return MegaAdapter(url, proxies=proxies)
-    else:
-        # Fallback to single file if direct link (e.g., https://example.com/file.ext)
-        if parsed.path.endswith(('.zip', '.mp4', '.jpg', '.png', '.pdf')):  # Add more extensions as needed
-            return SingleFileAdapter(url, proxies=proxies)
-        raise ValueError("Site not supported yet")
+    def settle(self, file_id, result):
+        # Returns (album name, {state: count}) when this was the album's last file
+        def fn(db):
+            db.execute("UPDATE files SET state = ?, worker = NULL WHERE id = ?", (result, file_id))
+            album = db.execute("SELECT album FROM files WHERE id = ?", (file_id,)).fetchone()[0]
+            return self._complete(db, album)
+        return self._write(fn)
 
-# =============================
-# ALBUM QUEUE & WORKER
-# =============================
-album_queue = queue.Queue()
+    def _complete(self, db, album):
+        if db.execute("SELECT 1 FROM files WHERE album = ? AND state IN ('pending', 'leased') LIMIT 1",
+                      (album,)).fetchone():
+            return None
+        if not db.execute("UPDATE albums SET state = 'done' WHERE id = ? AND state = 'listed'", (album,)).rowcount:
+            return None
+        name = db.execute("SELECT name FROM albums WHERE id = ?", (album,)).fetchone()[0]
+        return name, dict(db.execute("SELECT state, COUNT(*) FROM files WHERE album = ? GROUP BY state", (album,)))
 
-def queue_worker(status_cb=print, unzip=False, proxies=None, max_workers=MAX_WORKERS):
-    while True:
-        url = album_queue.get()
-        if url is None:
-            break
+    def drained(self):
+        return not self._read(
+            "SELECT 1 FROM albums WHERE state IN ('queued', 'listing') UNION ALL "
+            "SELECT 1 FROM files WHERE state IN ('pending', 'leased') LIMIT 1"
+        )
+
+    def lock_target(self, path):
+        # Exclusive lock on one target across processes and hosts (Linux NFS carries
+        # flock as a POSIX lock), held until the returned file is closed. None while a
+        # worker whose lease ran out is still writing it. Without fcntl the lease alone
+        # keeps workers apart.
+        f = open(os.path.join(self.lock_dir, hashlib.sha1(path.encode()).hexdigest()), "a")
         try:
-            adapter = get_adapter(url, proxies=proxies)
-            album_name = adapter.get_album_name()
-            files = adapter.get_files()
-            output_dir = os.path.join(BASE_DIR, album_name)
-            os.makedirs(output_dir, exist_ok=True)
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            pass
+        except OSError:
+            f.close()
+            return None
+        return f
 
-            with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                results = list(ex.map(lambda f: adapter.download_file(f, output_dir), files))
+def worker_mode(queue_path, status_cb=print, proxies=None, threads=MAX_WORKERS, follow=False, unzip=False):
+    # One worker process: lists albums nobody is listing and downloads leased files on
+    # `threads` threads. Start as many as wanted, here or on hosts sharing BASE_DIR; each
+    # exits once the queue is drained unless follow is set. With unzip, the worker that
+    # downloaded a zip extracts it.
+    work = WorkQueue(queue_path)
+    extractor = Extractor(status_cb) if unzip else None
+    extracting = threading.Semaphore(0)  # released once per extraction that finished
+    extractions = 0
+    me = f"{socket.gethostname()}:{os.getpid()}"
+    held_files, held_albums = set(), set()
+    adapters = {}
+    state_lock = threading.Lock()
+    stop = threading.Event()
 
-            if unzip:
-                for file in files:
-                    path = os.path.join(output_dir, file["name"])
-                    if path.endswith(".zip") and os.path.exists(path):
-                        with zipfile.ZipFile(path, "r") as z:
-                            z.extractall(output_dir)
-                        os.remove(path)  # Optional: remove zip after extract
+    def heartbeat():
+        while not stop.wait(LEASE_SECONDS / 3):
+            with state_lock:
+                files, albums = list(held_files), list(held_albums)
+            try:
+                work.renew(me, files, albums)
+            except sqlite3.Error as e:
+                print(f"\n⚠ Lease renewal failed: {e}")
+
+    def adapter_for(url):
+        with state_lock:
+            if url not in adapters:
+                adapters[url] = get_adapter(url, proxies=proxies)
+            return adapters[url]
 
-            status_cb(f"Album '{album_name}' done: {results.count('downloaded')} downloaded, {results.count('skipped')} skipped")
+    def list_album(album, url):
+        try:
+            with tracer.span("listing", "listing", url=url):
+                adapter = adapter_for(url)
+                name = adapter.get_album_name()
+                for batch in batched(adapter.iter_files()):
+                    done = set() if REVALIDATE else manifest.completed(adapter, batch, os.path.join(BASE_DIR, name))
+                    work.add_files(album, name, batch, [adapter.file_key(f) in done for f in batch])
+            report(work.listed(album, name))
         except Exception as e:
-            status_cb(f"Error: {e}")
-        album_queue.task_done()
+            status_cb(f"Error listing {url}: {e}")
+            work.album_failed(album, str(e))
+        finally:
+            with state_lock:
+                held_albums.discard(album)
+
+    def run_file(job):
+        rel = job["path"]
+        lock = work.lock_target(rel)
+        if lock is None:
+            # Its last worker is alive after all; the lease goes back to that worker
+            with state_lock:
+                held_files.discard(job["id"])
+            return
+        file = job["entry"]
+        started = time.monotonic()
+        try:
+            with tracer.span("file", "file", file=file.get("name")) as span:
+                try:
+                    adapter = adapter_for(job["url"])
+                    output_dir = os.path.join(BASE_DIR, rel.split("/")[0])
+                    os.makedirs(output_dir, exist_ok=True)
+                    result = adapter.download_file(file, output_dir)
+                except Exception as e:
+                    print(f"\n❌ Error downloading {file.get('name')}: {e}")
+                    result = "failed"
+                span.set(result=result)
+            host = urlparse(file.get("url") or job["url"]).netloc
+            metrics.inc("files_total", host=host, result=result)
+            metrics.observe("transfer_seconds", time.monotonic() - started, host=host)
+            report(work.settle(job["id"], result))
+            if extractor is not None and result == "downloaded":
+                extract(os.path.join(output_dir, *file["name"].split("/")), output_dir)
+        finally:
+            with state_lock:
+                held_files.discard(job["id"])
+            lock.close()
+
+    def extract(path, output_dir):
+        nonlocal extractions
+        if not path.endswith(".zip") or not os.path.exists(path):
+            return
+        with state_lock:
+            extractions += 1
+        extractor.submit(path, output_dir, extracting.release)
+
+    def report(finished):
+        if finished:
+            name, counts = finished
+            status_cb(f"Album '{name}' done: " + ", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    status_cb(f"Worker {me} on {queue_path}")
+    running = set()
+    listing = None
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="worker") as pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="lister") as lister:
+        while True:
+            if listing is None or listing.done():
+                leased = work.lease_album(me)
+                listing = None
+                if leased:
+                    with state_lock:
+                        held_albums.add(leased[0])
+                    listing = lister.submit(list_album, *leased)
+            running = {f for f in running if not f.done()}
+            for job in work.lease_files(me, threads - len(running)):
+                with state_lock:
+                    held_files.add(job["id"])
+                running.add(pool.submit(run_file, job))
+            if running or listing is not None:
+                wait_futures(running | ({listing} if listing else set()), timeout=0.5, return_when=FIRST_COMPLETED)
+            elif follow or not work.drained():
+                time.sleep(1)  # Files leased by other workers may come back
+            else:
+                break
+    for _ in range(extractions):
+        extracting.acquire()
+    stop.set()
+    status_cb(f"Worker {me}: queue drained")
 
 # =============================
 # CLI
 # =============================
 def cli_mode():
+    global SEGMENTS, ORDER, REVALIDATE, HASH_ALGO, CHUNK_SIZE, MAX_CHUNK_SIZE, STORE_DIR, STORE_LINK, SQLITE_JOURNAL
+    global WRITE_BEHIND_MB, FSYNC, FREE_SPACE_MARGIN_MB
     parser = argparse.ArgumentParser(description="MegaDL CLI")
-    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS, help="Max concurrent downloads")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="Transfer engine (async needs aiohttp)")
+    parser.add_argument("--max-workers", type=int, help=f"Max concurrent downloads (default: {MAX_WORKERS}, {ASYNC_MAX_IN_FLIGHT} with --engine async)")
+    parser.add_argument("--per-host", type=int, help=f"Max concurrent downloads per host, 0 = no cap (default: {PER_HOST_WORKERS}, max workers with --engine async)")
     parser.add_argument("--proxy", help="Proxy URL (e.g., http://proxy:port)")
+    parser.add_argument("--proxy-file", help="File with one proxy URL per line; requests are spread over the healthy ones")
     parser.add_argument("urls", nargs="*", help="Album or file URLs")
     parser.add_argument("--file", help="Text file with URLs (one per line)")
     parser.add_argument("--unzip", action="store_true", help="Unzip downloaded .zip files")
+    parser.add_argument("--segments", type=int, default=SEGMENTS, help="Parallel connections per large file (1 = off)")
+    parser.add_argument("--order", choices=["listing", "largest", "smallest"], default=ORDER,
+                        help="Which waiting file of an album starts next; largest also splits files that would finish last")
+    parser.add_argument("--speed-limit", type=int, default=SPEED_LIMIT_KB, help="Total bandwidth cap in KB/s (0 = unlimited)")
+    parser.add_argument("--host-speed-limit", type=int, default=HOST_SPEED_LIMIT_KB, help="Per-host bandwidth cap in KB/s (0 = unlimited)")
+    parser.add_argument("--listing-ttl", type=int, default=LISTING_TTL, help="Reuse cached album listings for this many seconds (0 = off)")
+    parser.add_argument("--revalidate", action="store_true", help="Re-check completed files with the host instead of trusting the manifest")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // 1024, help="Initial read size in KB; grows while the link keeps up")
+    parser.add_argument("--write-behind", type=int, default=WRITE_BEHIND_MB, metavar="MB",
+                        help="Downloaded data per filesystem that may wait for its writer thread before transfers wait")
+    parser.add_argument("--fsync", choices=["never", "close", "checkpoint"], default=FSYNC,
+                        help="Sync finished files before their rename (close), and also resume checkpoints (checkpoint)")
+    parser.add_argument("--min-free", type=int, default=FREE_SPACE_MARGIN_MB, metavar="MB",
+                        help="Free space an album must leave on its filesystem, by the sizes the host lists, to be started")
+    parser.add_argument("--store", nargs="?", const="", metavar="DIR",
+                        help="Keep every file once in a content store shared by all albums and link it into each (default DIR: downloads/.store)")
+    parser.add_argument("--store-link", choices=["hardlink", "reflink", "copy"], default=STORE_LINK,
+                        help="How stored files are placed in albums; falls back to a copy where the filesystem cannot")
+    parser.add_argument("--hash", default=HASH_ALGO, help="Hash computed while downloading, checked against host/manifest hashes (\"\" = off)")
+    parser.add_argument("--pool-size", type=int, help="Keep-alive connections per host (default: max workers x segments)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint binds to")
+    parser.add_argument("--metrics-file", help=f"Append a JSON line of metrics to this file every {METRICS_INTERVAL}s")
+    parser.add_argument("--trace", help="Record per-phase spans and save them as Chrome/Perfetto trace JSON")
+    parser.add_argument("--daemon", action="store_true", help="Keep running with a persistent job queue and an HTTP API for submitting albums")
+    parser.add_argument("--api-port", type=int, default=9309, help="Port of the --daemon job API")
+    parser.add_argument("--api-host", default="127.0.0.1", help="Address the --daemon job API binds to")
+    parser.add_argument("--worker", action="store_true", help="Take leased file jobs from a queue shared with other worker processes or hosts")
+    parser.add_argument("--queue", help="Shared queue database for --worker (default: downloads/.work.sqlite)")
+    parser.add_argument("--follow", action="store_true", help="With --worker, keep waiting for new albums once the queue is drained")
     args = parser.parse_args()
 
+    SEGMENTS = max(1, args.segments)
+    ORDER = args.order
+    CHUNK_SIZE = max(4, args.chunk_size) * 1024
+    MAX_CHUNK_SIZE = max(MAX_CHUNK_SIZE, CHUNK_SIZE)
+    WRITE_BEHIND_MB = max(1, args.write_behind)
+    FSYNC = args.fsync
+    FREE_SPACE_MARGIN_MB = max(0, args.min_free)
+    if args.max_workers is None:
+        args.max_workers = ASYNC_MAX_IN_FLIGHT if args.engine == "async" else MAX_WORKERS
+    if args.per_host is None:
+        args.per_host = args.max_workers if args.engine == "async" else PER_HOST_WORKERS
+    sessions.configure(args.pool_size or args.max_workers * SEGMENTS)
+    limiter.set_limits(args.speed_limit, args.host_speed_limit)
+    listing_cache.ttl = args.listing_ttl
+    REVALIDATE = args.revalidate
+    if args.store is not None:
+        STORE_DIR = args.store
+        store.enabled = True
+    STORE_LINK = args.store_link
+    HASH_ALGO = args.hash
+    if HASH_ALGO and HASH_ALGO not in hashlib.algorithms_available:
+        parser.error(f"unknown hash algorithm: {HASH_ALGO}")
+
     proxies = {"http": args.proxy, "https": args.proxy} if args.proxy else None
+    if args.proxy_file:
+        print(f"Proxy pool: {proxy_pool.load(args.proxy_file)} proxies")
 
     urls = args.urls
     if args.file:
         with open(args.file, "r") as f:
             urls.extend([line.strip() for line in f if line.strip()])
 
-    for url in urls:
-        album_queue.put(url)
+    jobs = None
+    if args.worker and args.engine != "threads":
+        parser.error("--worker runs its file jobs on threads; --engine async is not supported with it")
+    if args.worker:
+        # Workers on other hosts may share these databases over a network filesystem
+        SQLITE_JOURNAL = "DELETE"
+        args.queue = args.queue or os.path.join(BASE_DIR, ".work.sqlite")
+        work = WorkQueue(args.queue)
+        for url in urls:
+            work.submit(url)
+    elif args.daemon:
+        # Unfinished jobs from the last run go first, then the URLs given here
+        jobs = JobQueue()
+        jobs.start()
+        for url in urls:
+            jobs.submit(url)
+    else:
+        for url in urls:
+            album_queue.put(url)
 
-    threading.Thread(target=queue_worker, args=(print, args.unzip, proxies, args.max_workers), daemon=True).start()  # Pass unzip flag
-    album_queue.join()
+    if args.trace:
+        tracer.start()
+    if args.metrics_port:
+        serve_metrics(args.metrics_port, args.metrics_host)
+    stop_render = threading.Event()
+    renderer = threading.Thread(target=render_progress, args=(stop_render,), daemon=True)
+    renderer.start()
+    if args.metrics_file:
+        dumper = threading.Thread(target=dump_metrics, args=(args.metrics_file, stop_render), daemon=True)
+        dumper.start()
+    if not args.worker:
+        threading.Thread(target=queue_worker, args=(cli_status, args.unzip, proxies, args.max_workers, args.per_host, args.engine, jobs), daemon=True).start()  # Pass unzip flag
+    if args.worker:
+        worker_mode(args.queue, cli_status, proxies, args.max_workers, args.follow, args.unzip)
+    elif args.daemon:
+        serve_api(jobs, args.api_port, args.api_host)
+        cli_status(f"Daemon: job API on http://{args.api_host}:{args.api_port}/jobs, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass  # Unfinished jobs are picked up again by the next --daemon run
+    else:
+        album_queue.join()
+    stop_render.set()
+    renderer.join()
+    if args.metrics_file:
+        dumper.join()
+    if args.trace:
+        tracer.save(args.trace)
+        print(f"Trace: {args.trace} (open in https://ui.perfetto.dev or chrome://tracing)")
+    print(f"HTTP: {sessions.summary()}")
+    print(f"Hosts: {rate_control.summary()}")
+    if proxy_pool.proxies:
+        print(f"Proxies: {proxy_pool.summary()}")
+    if disk_writers.writers:
+        print(f"Disk: {disk_writers.summary()}")
 
 # =============================
 # GUI
 # =============================
 
 def gui_mode():
+    import tkinter as tk
+    from tkinter import ttk
+
     root = tk.Tk()
     root.title("MegaDL")
-    root.geometry("480x400")
+    root.geometry("480x460")
 
     tk.Label(root, text="Drag & drop album URLs here", bg="#121212", fg="#ffffff", font=("Arial", 12)).pack(pady=20)
 
@@ -581,8 +4302,10 @@ def gui_mode():
     queue_list = tk.Listbox(root, height=5, width=50)
     queue_list.pack(pady=10)
 
-    progress = ttk.Progressbar(root, mode="indeterminate")
-    progress.pack(pady=10)
+    progress_bar = ttk.Progressbar(root, mode="determinate", maximum=100)
+    progress_bar.pack(pady=10)
+    rate = tk.StringVar(value="")
+    tk.Label(root, textvariable=rate).pack()
 
     def add_album():
         url = entry.get().strip()
@@ -604,12 +4327,42 @@ def gui_mode():
 
     tk.Button(root, text="Pause/Resume", command=pause_resume, bg="#1f4e5f", fg="#ffffff").pack(pady=5)
 
-    def worker_with_progress(status_cb):
-        progress.start()
-        queue_worker(status_cb)
-        progress.stop()
+    speed_frame = tk.Frame(root)
+    speed_frame.pack(pady=5)
+    tk.Label(speed_frame, text="Speed limit (KB/s, 0 = unlimited)").pack(side=tk.LEFT)
+    speed_limit = tk.StringVar(value=str(SPEED_LIMIT_KB))
+
+    def apply_speed_limit(*_):
+        try:
+            kb = int(speed_limit.get())
+        except ValueError:
+            return
+        limiter.set_limits(total_kb=kb)
+        status.set(f"Speed limit: {kb} KB/s" if kb > 0 else "Speed limit: unlimited")
+
+    tk.Spinbox(speed_frame, from_=0, to=1000000, increment=128, width=8, textvariable=speed_limit,
+               command=apply_speed_limit).pack(side=tk.LEFT, padx=5)
+    speed_limit.trace_add("write", apply_speed_limit)
+
+    def poll_progress():
+        # Worker threads only touch the hub; Tk widgets are updated here on the main loop
+        snap = progress.snapshot()
+        if snap["message"]:
+            status.set(snap["message"])
+        albums = snap["albums"]
+        files_done = sum(done for _, done, _ in albums)
+        files_total = sum(total for _, _, total in albums)
+        if files_total:
+            # Finished files plus the share of the active ones already transferred
+            fraction = snap["active_fraction"] or 0.0
+            progress_bar["value"] = 100 * (files_done + fraction * len(snap["active"])) / files_total
+        elif not snap["active"]:
+            progress_bar["value"] = 0
+        rate.set(progress_line(snap) if snap["active"] or albums else "")
+        root.after(250, poll_progress)
 
-    threading.Thread(target=worker_with_progress, args=(lambda s: status.set(s),), daemon=True).start()
+    threading.Thread(target=queue_worker, args=(progress.post,), daemon=True).start()
+    poll_progress()
 
     root.mainloop()
 
@@ -617,6 +4370,8 @@ def gui_mode():
 # ENTRY POINT
 # =============================
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Extract workers in the frozen .exe
+    sys.modules.setdefault("mega_dl", sys.modules[__name__])  # Plugins importing mega_dl share this copy
     os.makedirs(BASE_DIR, exist_ok=True)
     if len(sys.argv) > 1:
         cli_mode()